@@ -0,0 +1,253 @@
+# Clocks used for the timing of the dome controller
+#
+# A clock object provides:
+#   now()                       monotonic time in seconds, for intervals and timeouts
+#   time()                      unix time, for timestamps
+#   sleep(seconds)              wait for a number of seconds
+#   waituntil(deadline, event)  wait until the deadline (None for no deadline)
+#                               or until the event (from event()) is set
+#   event()                     new event object with set(), clear(), is_set()
+# system is the real clock. A VirtualClock runs on simulated time, which only
+# advances when all threads taking part are waiting, so the controller can be
+# run deterministically and much faster than real time.
+
+import sys, time, threading
+
+INF = float('inf')
+
+
+def _monotonic():
+    # High resolution monotonic clock function of this platform
+    # time.clock() can not be used everywhere: it is a high resolution wall
+    # clock on Windows but processor time on other platforms, and time.time()
+    # jumps with changes of the system time and only has a resolution of 15 ms
+    # on Windows.
+    if hasattr(time, 'perf_counter'):
+        # Python 3
+        return time.perf_counter
+    if sys.platform == 'win32':
+        # QueryPerformanceCounter
+        return time.clock
+    if sys.platform.startswith('linux'):
+        try:
+            import ctypes
+            try:
+                # glibc, find_library runs ldconfig in a subprocess which slows down every import
+                libc = ctypes.CDLL('libc.so.6', use_errno=True)
+            except OSError:
+                import ctypes.util
+                libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            class timespec(ctypes.Structure):
+                _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+            CLOCK_MONOTONIC = 1
+            def monotonic():
+                t = timespec()
+                if libc.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+                    raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+                return t.tv_sec + t.tv_nsec * 1e-9
+            monotonic()
+            return monotonic
+        except (OSError, AttributeError, TypeError):
+            pass
+    return time.time
+
+
+class RealClock(object):
+    # Clock following the real time
+
+    now = staticmethod(_monotonic())
+    time = staticmethod(time.time)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def waituntil(self, deadline, event=None):
+        if event is None:
+            if deadline is not None:
+                time.sleep(max(deadline - self.now(), 0))
+        elif deadline is None:
+            event.wait()
+        else:
+            event.wait(max(deadline - self.now(), 0))
+
+    def event(self):
+        return threading.Event()
+
+
+system = RealClock()
+now = system.now
+
+
+class VirtualClock(object):
+    # Clock on simulated time
+    # Threads taking part in the simulation are started with start(), a thread
+    # already running takes part after enter(). Time only advances when every
+    # taking part thread waits on the clock, it then jumps to the first
+    # deadline. Threads must not block on anything else than the clock.
+    # Waiting threads are woken one at a time, in order of their deadline and
+    # then in the order they started waiting, and the next one is only woken
+    # when the previous one waits again. So only one taking part thread runs
+    # at any moment and a simulation gives the same result on every run.
+    #
+    # A thread polling hardware can be given a horizon function with
+    # sethorizon(). It gets the current time and returns the first time at
+    # which the polled input can change. Sleeps of such a thread do not make
+    # the clock stop before that time, the thread still wakes after another
+    # thread ran past its own deadline, so it sees every change made by other
+    # threads. This skips polls which would read the same value anyway.
+
+    def __init__(self, start=0., resolution=1e-6, epoch=None):
+        self.lock = threading.Lock()
+        self.current = start
+        self.epoch = time.time() if epoch is None else epoch   # Unix time at time 0
+        self.resolution = resolution    # Minimum step of a sleep
+        self.participants = 0           # Number of threads taking part
+        self.waiters = []
+        self.horizons = {}
+        self.halted = False
+        self.steps = 0                  # Number of times the time advanced
+        self.order = 0                  # Number of waits, orders waiters on the same deadline
+        self.runs = 0                   # Number of woken waiters
+
+    def now(self):
+        return self.current
+
+    def time(self):
+        return self.epoch + self.current
+
+    def sleep(self, seconds):
+        self.waituntil(self.current + max(seconds, self.resolution))
+
+    def waituntil(self, deadline, event=None):
+        if deadline is None:
+            deadline = INF
+        with self.lock:
+            if (event is not None and event.flag) or (deadline <= self.current and not self.halted):
+                return
+            self.order += 1
+            waiter = _Waiter(deadline, event, self.horizons.get(threading.current_thread().ident),
+                             self.order, self.runs)
+            self.waiters.append(waiter)
+            if event is not None:
+                event.waiters.append(waiter)
+            self._advance()
+        waiter.block()
+
+    def event(self):
+        return VirtualEvent(self)
+
+    def start(self, thread):
+        # Start a thread which takes part in the simulation
+        # The thread waits for its first turn from the start, so threads
+        # started together always get their turns in the same order
+        with self.lock:
+            self.participants += 1
+            self.order += 1
+            waiter = _Waiter(self.current, None, None, self.order, self.runs)
+            self.waiters.append(waiter)
+        run = thread.run
+        def participate():
+            try:
+                waiter.block()
+                run()
+            finally:
+                self.leave()
+        thread.run = participate
+        thread.start()
+
+    def enter(self):
+        # Let the calling thread take part in the simulation
+        with self.lock:
+            self.participants += 1
+
+    def leave(self):
+        # The calling thread no longer takes part in the simulation
+        with self.lock:
+            self.participants -= 1
+            self._advance()
+
+    def sethorizon(self, thread, horizon):
+        self.horizons[thread.ident] = horizon
+
+    def halt(self):
+        # Stop the time, waiting threads are never woken again
+        # Called by a taking part thread, which leaves the simulation. Returns
+        # once all other taking part threads wait.
+        with self.lock:
+            self.halted = True
+            self.participants -= 1
+        while True:
+            with self.lock:
+                if len(self.waiters) >= self.participants:
+                    return
+            time.sleep(0.001)
+
+    def _advance(self):
+        # Wake the first waiter if all taking part threads wait, advancing the
+        # time to its deadline
+        if self.halted or not self.waiters or len(self.waiters) < self.participants:
+            return
+        next, order, waiter = min((waiter.due(self.current, self.runs), waiter.order, waiter)
+                                  for waiter in self.waiters)
+        if next == INF:
+            return
+        if next > self.current:
+            self.current = next
+            self.steps += 1
+        self.waiters.remove(waiter)
+        if waiter.event is not None:
+            waiter.event.waiters.remove(waiter)
+        self.runs += 1
+        waiter.release()
+
+
+class _Waiter(object):
+    # A thread waiting on a VirtualClock
+
+    def __init__(self, deadline, event, horizon, order, runs):
+        self.deadline = deadline
+        self.event = event
+        self.horizon = horizon
+        self.order = order          # Position in the order of waiting
+        self.runs = runs            # Woken waiters of the clock when starting to wait
+        self.signalled = False      # The event was set
+        self.waiting = threading.Lock()
+        self.waiting.acquire()
+
+    def due(self, now, runs):
+        # Time at which this thread is to be woken, given the current time and
+        # the number of woken waiters of the clock
+        if self.signalled:
+            return now
+        if self.horizon is None or (self.deadline <= now and runs > self.runs):
+            return self.deadline
+        return max(self.deadline, self.horizon(now))
+
+    def block(self):
+        self.waiting.acquire()
+
+    def release(self):
+        self.waiting.release()
+
+
+class VirtualEvent(object):
+    # Event for waiting on a VirtualClock
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.flag = False
+        self.waiters = []
+
+    def set(self):
+        with self.clock.lock:
+            self.flag = True
+            # Waiters get their turn once the setting thread waits
+            for waiter in self.waiters:
+                waiter.signalled = True
+            self.clock._advance()
+
+    def clear(self):
+        self.flag = False
+
+    def is_set(self):
+        return self.flag
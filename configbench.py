@@ -0,0 +1,214 @@
+# Benchmarks of the config handling of koepelX
+#
+#   access   reading values as float(cfg['key']) against attributes of the
+#            typed settings (see settings.py)
+#   parse    parsing the config and a synthetic flat file of --lines lines with
+#            the single pass parser for flat files against the full parser
+#   validate validating the config and a synthetic config of --lines values
+#            with calls of Validator.check against the compiled checks
+#   interpolate  reading string values of a config with interpolation, plain
+#            and with references to other values, against reading them with
+#            interpolation switched off
+#   walk     walking and merging a wide config (--domes domes of --profiles
+#            profiles) and a deep one (--depth nested sections)
+#
+#   python configbench.py [--config config.ini] [--number 1000000] [benchmark ...]
+#
+# Without benchmarks all are run.
+
+import os, timeit, optparse, random
+from configobj import ConfigObj
+from validate import Validator
+
+# Values read in every pass of the tracking loop of koepelX
+ACCESS = ('pulsesPerDegree', 'trackStartFraction', 'domeOpeningAngle', 'trackInterval', 'checkInterval')
+
+
+class FullParser(ConfigObj):
+    # ConfigObj without the single pass parser for flat files
+
+    def _parse_flat(self, infile):
+        return False
+
+
+def synthetic(lines, seed=1):
+    # Lines of a flat config file like config.ini: comment lines, numbers,
+    # words and quoted strings, some with an inline comment
+    rand = random.Random(seed)
+    result = []
+    for i in range(lines):
+        kind = rand.random()
+        if kind < 0.3:
+            result.append('# Comment on the next value %d' % i)
+        elif kind < 0.35:
+            result.append('')
+        elif kind < 0.7:
+            result.append('value%d = %.6g' % (i, rand.uniform(-1000., 1000.)))
+        elif kind < 0.85:
+            result.append('option%d = %s    # inline comment' % (i, rand.choice(['reactive', 'sidereal', 'True', 'auto'])))
+        else:
+            result.append('path%d = "dir/file %d.txt"' % (i, i))
+    return result
+
+
+class CheckValidator(object):
+    # Validator used through check() and get_default_value() per value, as
+    # ConfigObj.validate does for validators without compiled checks
+
+    def __init__(self):
+        validator = Validator()
+        self.check = validator.check
+        self.get_default_value = validator.get_default_value
+        self.baseErrorClass = validator.baseErrorClass
+
+
+SPECS = ('float', 'float(0, 360)', 'float(min=-90, max=90, default=0)', 'integer(1, 100)',
+         'integer(default=5)', 'boolean(default=False)', 'string', "option('reactive', 'sidereal', 'extrapolate')")
+VALUES = ('%.6g', '%.6g', '%.6g', '%d', '%d', 'True', 'text %d', 'sidereal')
+
+
+def synthetic_spec(lines, seed=1):
+    # Lines of a configspec with checks like configspec.ini and of a config
+    # with valid values for it, some left to their defaults
+    rand = random.Random(seed)
+    spec, config = [], []
+    for i in range(lines):
+        kind = rand.randrange(len(SPECS))
+        spec.append('value%d = %s' % (i, SPECS[kind]))
+        if 'default' not in SPECS[kind] or rand.random() < 0.5:
+            value = VALUES[kind]
+            if '%' in value:
+                value = value % (rand.randint(1, 90),)
+            config.append('value%d = %s' % (i, value))
+    return spec, config
+
+
+def wide(domes, profiles, values=20):
+    # Lines of a config with a section per dome holding a section per profile
+    lines = ['value%d = %d' % (i, i) for i in range(values)]
+    for dome in range(domes):
+        lines.append('[dome%d]' % dome)
+        lines += ['value%d = %d' % (i, i) for i in range(values)]
+        for profile in range(profiles):
+            lines.append('[[profile%d]]' % profile)
+            lines += ['value%d = %d' % (i, i) for i in range(values)]
+    return lines
+
+
+def deep(depth, values=5):
+    # Lines of a config of depth nested sections
+    lines = []
+    for level in range(1, depth + 1):
+        lines.append('%s[%s%d%s]' % ('  ' * (level - 1), '[' * (level - 1), level, ']' * (level - 1)))
+        lines += ['%svalue%d = %d' % ('  ' * level, i, i) for i in range(values)]
+    return lines
+
+
+def load(path):
+    # Validated config with the configspec of its directory, as koepelX reads it
+    cfg = ConfigObj(path, configspec=os.path.join(os.path.dirname(path), 'configspec.ini'))
+    cfg.stringify = True
+    cfg.validate(Validator())
+    return cfg
+
+
+def _time(statement, setup, number):
+    # Seconds per execution of statement, best of three
+    return min(timeit.Timer(statement, setup).repeat(3, number)) / number
+
+
+def access(options):
+    setup = 'import configbench, settings; cfg = configbench.load(%r); Settings = settings.fromconfig(cfg)' % (options.config,)
+    print('Reading %d values, %d times' % (len(ACCESS), options.number))
+    results = []
+    for name, statement in (("float(cfg['key'])", ' + '.join("float(cfg['%s'])" % key for key in ACCESS)),
+                            ("cfg['key']", ' + '.join("cfg['%s']" % key for key in ACCESS)),
+                            ('Settings.key', ' + '.join('Settings.%s' % key for key in ACCESS))):
+        seconds = _time(statement, setup, options.number) / len(ACCESS)
+        results.append(seconds)
+        print('  %-20s %8.1f ns per value, %5.1fx' % (name, seconds * 1e9, results[0] / seconds))
+
+
+def parse(options):
+    for name, lines in (('config file', open(options.config).read().splitlines()),
+                        ('synthetic, %d lines' % options.lines, synthetic(options.lines))):
+        number = max(1, options.number // (100 * len(lines)))
+        print('Parsing %s, %d times' % (name, number))
+        results = []
+        for parser in (FullParser, ConfigObj):
+            seconds = min(timeit.Timer(lambda: parser(lines)).repeat(3, number)) / number
+            results.append(seconds)
+            print('  %-20s %8.3f ms, %5.1fx' % (parser.__name__, seconds * 1e3, results[0] / seconds))
+        assert FullParser(lines).dict() == ConfigObj(lines).dict()
+
+
+def validate(options):
+    spec = os.path.join(os.path.dirname(options.config), 'configspec.ini')
+    for name, (spec, lines) in (('config file', (open(spec).read().splitlines(), open(options.config).read().splitlines())),
+                                ('synthetic, %d values' % options.lines, synthetic_spec(options.lines))):
+        number = max(1, options.number // (100 * len(spec)))
+        print('Validating %s, %d times' % (name, number))
+        results = []
+        for label, validator in (('check()', CheckValidator), ('compiled', Validator)):
+            best = None
+            for repeat in range(3):
+                # validate() converts the values, so every run gets a fresh config
+                configs = [ConfigObj(lines, configspec=spec) for i in range(number)]
+                v = validator()
+                start = timeit.default_timer()
+                for cfg in configs:
+                    assert cfg.validate(v) is True
+                seconds = (timeit.default_timer() - start) / number
+                best = seconds if best is None else min(best, seconds)
+            results.append(best)
+            print('  %-20s %8.3f ms, %6.0f values/ms, %5.1fx' % (label, best * 1e3, len(spec) / (best * 1e3), results[0] / best))
+
+
+def interpolate(options):
+    lines = ['site = Blaauw', 'dome = $site dome', 'log = ${dome}/log/$site', '[telescope]', 'name = $dome telescope']
+    setup = 'from configobj import ConfigObj; cfg = ConfigObj(%r, interpolation=%%r); section = cfg["telescope"]' % (lines,)
+    print('Reading string values, %d times' % (options.number,))
+    for name, statement in (('plain', "cfg['site']"), ('one reference', "cfg['dome']"),
+                            ('two references', "cfg['log']"), ('in a subsection', "section['name']")):
+        results = []
+        for interpolation in (False, 'template'):
+            results.append(_time(statement, setup % (interpolation,), options.number))
+        print('  %-20s %8.1f ns, %8.1f ns without interpolation' % (name, results[1] * 1e9, results[0] * 1e9))
+
+
+def walk(options):
+    def nothing(section, key):
+        pass
+
+    for name, lines in (('wide, %d sections' % (options.domes * (options.profiles + 1)), wide(options.domes, options.profiles)),
+                        ('deep, %d sections' % options.depth, deep(options.depth))):
+        cfg = ConfigObj(lines)
+        other = ConfigObj(lines).dict()
+        number = max(1, options.number // (100 * len(lines)))
+        print('Walking and merging %s, %d times' % (name, number))
+        for label, statement in (('walk', lambda: cfg.walk(nothing)),
+                                 ('walk, on sections', lambda: cfg.walk(nothing, call_on_sections=True)),
+                                 ('merge', lambda: cfg.merge(other))):
+            seconds = min(timeit.Timer(statement).repeat(3, number)) / number
+            print('  %-20s %8.3f ms' % (label, seconds * 1e3))
+
+
+BENCHMARKS = (('access', access), ('parse', parse), ('validate', validate), ('interpolate', interpolate), ('walk', walk))
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [benchmark ...]')
+    parser.add_option('--config', default='config.ini', help='config file of koepelX [%default]')
+    parser.add_option('--number', type='int', default=1000000, help='number of repetitions [%default]')
+    parser.add_option('--lines', type='int', default=10000, help='lines of the synthetic config file [%default]')
+    parser.add_option('--domes', type='int', default=20, help='domes of the wide config [%default]')
+    parser.add_option('--profiles', type='int', default=20, help='profiles per dome of the wide config [%default]')
+    parser.add_option('--depth', type='int', default=200, help='depth of the deep config [%default]')
+    options, names = parser.parse_args()
+    for name, benchmark in BENCHMARKS:
+        if not names or name in names:
+            benchmark(options)
+
+
+if __name__ == '__main__':
+    main()
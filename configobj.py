@@ -24,12 +24,8 @@ if INTP_VER < (2, 2):
     raise RuntimeError("Python v.2.2 or later needed")
 
 import os, re
+# The compiler module is only needed for unrepr mode, it is imported by getObj
 compiler = None
-try:
-    import compiler
-except ImportError:
-    # for IronPython
-    pass
 from types import StringTypes
 from warnings import warn
 try:
@@ -93,6 +89,63 @@ def match_utf8(encoding):
     return BOM_LIST.get(encoding.lower()) == 'utf_8'
 
 
+def _new_digest():
+    """Return a new digest for comparing files (sha1)."""
+    try:
+        from hashlib import sha1
+    except ImportError:
+        # Python 2.4
+        from sha import new as sha1
+    return sha1()
+
+
+def _file_digest(filename):
+    """Return the digest of a file, or ``None`` if it cannot be read."""
+    digest = _new_digest()
+    try:
+        h = open(filename, 'rb')
+    except IOError:
+        return None
+    try:
+        while True:
+            data = h.read(65536)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        h.close()
+    return digest.digest()
+
+
+def _replace(source, destination):
+    """Rename a file over another one, replacing it."""
+    if os.name == 'nt':
+        # os.rename does not replace files on Windows
+        import ctypes
+        MOVEFILE_REPLACE_EXISTING, MOVEFILE_WRITE_THROUGH = 0x1, 0x8
+        if isinstance(source, str):
+            source = source.decode(sys.getfilesystemencoding())
+        if isinstance(destination, str):
+            destination = destination.decode(sys.getfilesystemencoding())
+        if not ctypes.windll.kernel32.MoveFileExW(source, destination,
+                MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+            raise ctypes.WinError()
+        return
+    os.rename(source, destination)
+    # sync the directory, so the rename itself is on disk
+    try:
+        fd = os.open(os.path.dirname(destination) or os.curdir, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+    finally:
+        os.close(fd)
+
+
 # Quote strings used for writing values
 squot = "'%s'"
 dquot = '"%s"'
@@ -168,9 +221,14 @@ OPTION_DEFAULTS = {
 
 
 def getObj(s):
+    global compiler
     s = "a=" + s
     if compiler is None:
-        raise ImportError('compiler module not available')
+        try:
+            import compiler
+        except ImportError:
+            # for IronPython
+            raise ImportError('compiler module not available')
     p = compiler.parse(s)
     return p.getChildren()[1].getChildren()[0].getChildren()[1]
 
@@ -396,21 +454,20 @@ class InterpolationEngine(object):
 
         Returns a 2-tuple: the value, and the section where it was found.
         """
-        # switch off interpolation before we try and fetch anything !
-        save_interp = self.section.main.interpolation
-        self.section.main.interpolation = False
-
+        # values are fetched with dict.get, so without interpolation
         # Start at section that "owns" this InterpolationEngine
         current_section = self.section
         while True:
             # try the current section first
-            val = current_section.get(key)
+            val = dict.get(current_section, key)
             if val is not None:
                 break
             # try "DEFAULT" next
-            val = current_section.get('DEFAULT', {}).get(key)
-            if val is not None:
-                break
+            default_section = dict.get(current_section, 'DEFAULT')
+            if isinstance(default_section, dict):
+                val = dict.get(default_section, key)
+                if val is not None:
+                    break
             # move up to parent and try again
             # top-level's parent is itself
             if current_section.parent is current_section:
@@ -418,8 +475,6 @@ class InterpolationEngine(object):
                 break
             current_section = current_section.parent
 
-        # restore interpolation to previous value before returning
-        self.section.main.interpolation = save_interp
         if val is None:
             raise MissingInterpolationOption(key)
         return val, current_section
@@ -553,6 +608,10 @@ class Section(dict):
 
 
     def _interpolate(self, key, value):
+        # interpolated values are cached in the main ConfigObj by section and
+        # key (see __getitem__), the entry keeps the section alive so its id
+        # is not reused
+        cache = self.main._interpolation_cache
         try:
             # do we already have an interpolation engine?
             engine = self._interpolation_engine
@@ -572,13 +631,30 @@ class Section(dict):
                 # save reference to engine so we don't have to do this again
                 engine = self._interpolation_engine = class_(self)
         # let the engine do the actual work
-        return engine.interpolate(key, value)
+        result = engine.interpolate(key, value)
+        cache[id(self), key] = (self, value, result)
+        return result
+
+
+    def _changed(self):
+        """
+        Invalidate the interpolated values of the ConfigObj.
+        
+        Called after every change of a value or section. The cache is replaced
+        rather than cleared, so a value interpolated in another thread during
+        the change ends up in the old cache.
+        """
+        self.main._interpolation_cache = {}
 
 
     def __getitem__(self, key):
         """Fetch the item and do string interpolation."""
         val = dict.__getitem__(self, key)
-        if self.main.interpolation and isinstance(val, StringTypes):
+        main = self.main
+        if main.interpolation and isinstance(val, StringTypes):
+            entry = main._interpolation_cache.get((id(self), key))
+            if entry is not None and entry[1] is val:
+                return entry[2]
             return self._interpolate(key, val)
         return val
 
@@ -640,6 +716,7 @@ class Section(dict):
                 else:
                     raise TypeError('Value is not a string "%s".' % value)
             dict.__setitem__(self, key, value)
+        self._changed()
 
 
     def __delitem__(self, key):
@@ -651,6 +728,7 @@ class Section(dict):
             self.sections.remove(key)
         del self.comments[key]
         del self.inline_comments[key]
+        self._changed()
 
 
     def get(self, key, default=None):
@@ -675,6 +753,7 @@ class Section(dict):
         If key is not found, d is returned if given, otherwise KeyError is raised'
         """
         val = dict.pop(self, key, *args)
+        self._changed()
         if key in self.scalars:
             del self.comments[key]
             del self.inline_comments[key]
@@ -713,6 +792,7 @@ class Section(dict):
         self.comments = {}
         self.inline_comments = {}
         self.configspec = {}
+        self._changed()
 
 
     def setdefault(self, key, default=None):
@@ -814,12 +894,21 @@ class Section(dict):
         >>> c2
         {'section1': {'option1': 'False', 'subsection': {'more_options': 'False'}}}
         """
-        for key, val in indict.items():
-            if (key in self and isinstance(self[key], dict) and
-                                isinstance(val, dict)):
-                self[key].merge(val)
-            else:   
-                self[key] = val
+        # the sections being merged, depth first, instead of recursing
+        stack = [(self, iter(indict.items()))]
+        while stack:
+            section, items = stack[-1]
+            for key, val in items:
+                # the current value is only checked for being a section, so it
+                # is not interpolated
+                current = dict.get(section, key)
+                if isinstance(current, dict) and isinstance(val, dict):
+                    stack.append((current, iter(val.items())))
+                    break
+                section[key] = val
+            else:
+                stack.pop()
+        self._changed()
 
 
     def rename(self, oldkey, newkey):
@@ -842,6 +931,7 @@ class Section(dict):
         val = self[oldkey]
         dict.__delitem__(self, oldkey)
         dict.__setitem__(self, newkey, val)
+        self._changed()
         the_list.remove(oldkey)
         the_list.insert(pos, newkey)
         comm = self.comments[oldkey]
@@ -899,42 +989,51 @@ class Section(dict):
         >>> cfg
         {'CLIENT1section': {'CLIENT1key': 'CLIENT1value'}}
         """
-        out = {}
-        # scalars first
-        for i in range(len(self.scalars)):
-            entry = self.scalars[i]
-            try:
-                val = function(self, entry, **keywargs)
-                # bound again in case name has changed
-                entry = self.scalars[i]
-                out[entry] = val
-            except Exception:
-                if raise_errors:
-                    raise
-                else:
-                    entry = self.scalars[i]
-                    out[entry] = False
-        # then sections
-        for i in range(len(self.sections)):
-            entry = self.sections[i]
+        def walk_section(section, out):
+            # scalars first
+            for i in xrange(len(section.scalars)):
+                entry = section.scalars[i]
+                try:
+                    val = function(section, entry, **keywargs)
+                    # bound again in case name has changed
+                    entry = section.scalars[i]
+                    out[entry] = val
+                except Exception:
+                    if raise_errors:
+                        raise
+                    else:
+                        entry = section.scalars[i]
+                        out[entry] = False
+            # then sections, from the stack
+            return [section, out, 0, len(section.sections)]
+        
+        # the sections being walked, depth first, instead of recursing:
+        # [section, its results, index of the next subsection, subsections]
+        result = {}
+        stack = [walk_section(self, result)]
+        while stack:
+            frame = stack[-1]
+            section, out, i, count = frame
+            if i == count:
+                stack.pop()
+                continue
+            frame[2] = i + 1
+            entry = section.sections[i]
             if call_on_sections:
                 try:
-                    function(self, entry, **keywargs)
+                    function(section, entry, **keywargs)
                 except Exception:
                     if raise_errors:
                         raise
                     else:
-                        entry = self.sections[i]
+                        entry = section.sections[i]
                         out[entry] = False
                 # bound again in case name has changed
-                entry = self.sections[i]
+                entry = section.sections[i]
             # previous result is discarded
-            out[entry] = self[entry].walk(
-                function,
-                raise_errors=raise_errors,
-                call_on_sections=call_on_sections,
-                **keywargs)
-        return out
+            out[entry] = {}
+            stack.append(walk_section(section[entry], out[entry]))
+        return result
 
 
     def decode(self, encoding):
@@ -1114,6 +1213,7 @@ class Section(dict):
         """
         default = self.default_values[key]
         dict.__setitem__(self, key, default)
+        self._changed()
         if key not in self.defaults:
             self.defaults.append(key)
         return default
@@ -1219,6 +1319,43 @@ class ConfigObj(Section):
         $''',
         re.VERBOSE)
 
+    # regexes for the lines of flat files (see ``_parse_flat``)
+    # a blank or comment line, or an unindented ``key = value`` line with a
+    # single value without lists or triple quotes
+    _flat_line = re.compile(r'''^
+        (?:
+            \s*                        # blank or comment line
+        |
+            ([^\s'"=\[\#][^'"=]*?)      # 1: unquoted keyword, not indented
+            \s*=\s*                     # divider
+            (?:
+                "([^"]*)"|              # 2: double quotes
+                '([^']*)'|              # 3: single quotes
+                ([^'",\#\s][^'",\#]*?)   # 4: unquoted
+            )?                          # or an empty value
+        )
+        \s*(\#.*)?                      # 5: optional comment
+        $''',
+        re.VERBOSE)
+
+    # the same when lists are switched off, values are not unquoted
+    _flat_line_nolist = re.compile(r'''^
+        (?:
+            \s*                        # blank or comment line
+        |
+            ([^\s'"=\[\#][^'"=]*?)      # 1: unquoted keyword, not indented
+            \s*=\s*                     # divider
+            (
+                (?:"[^"]*")|            # 2: double quotes
+                (?:'[^']*')|            # single quotes
+                (?:[^'"\#\s][^\#]*?)|    # unquoted
+                (?:)                    # empty value
+            )
+        )
+        \s*(\#.*)?                      # 3: optional comment
+        $''',
+        re.VERBOSE)
+
     # regexes for finding triple quoted values on one line
     _single_line_single = re.compile(r"^'''(.*?)'''\s*(#.*)?$")
     _single_line_double = re.compile(r'^"""(.*?)"""\s*(#.*)?$')
@@ -1386,6 +1523,8 @@ class ConfigObj(Section):
         self.initial_comment = []
         self.final_comment = []
         self.configspec = {}
+        # interpolated values by (id(section), key), see Section._interpolate
+        self._interpolation_cache = {}
         
         # Clear section attributes as well
         Section._initialise(self)
@@ -1547,6 +1686,9 @@ class ConfigObj(Section):
 
     def _parse(self, infile):
         """Actually parse the config file."""
+        if not self.unrepr and self._parse_flat(infile):
+            return
+        
         temp_list_values = self.list_values
         if self.unrepr:
             self.list_values = False
@@ -1713,6 +1855,70 @@ class ConfigObj(Section):
         self.list_values = temp_list_values
 
 
+    def _parse_flat(self, infile):
+        """
+        Parse a flat config file in a single pass.
+        
+        Flat files have no sections, indentation, list values, triple quoted
+        values or duplicate keys; every line is matched with one compiled
+        regex. Returns ``False`` without changing anything as soon as a line
+        is not flat, the file is then parsed by ``_parse``. The result is the
+        same as that of ``_parse``.
+        """
+        if self.list_values:
+            match = self._flat_line.match
+        else:
+            match = self._flat_line_nolist.match
+        entries = []
+        keys = set()
+        comment_list = []
+        initial_comment = None
+        reset_comment = False
+        for line in infile:
+            if reset_comment:
+                comment_list = []
+            mat = match(line)
+            if mat is None:
+                return False
+            key = mat.group(1)
+            if key is None:
+                # blank or comment line
+                reset_comment = False
+                comment_list.append(line)
+                continue
+            if initial_comment is None:
+                initial_comment = comment_list
+                comment_list = []
+            reset_comment = True
+            if key in keys:
+                return False
+            keys.add(key)
+            if self.list_values:
+                (key, double, single, unquoted, comment) = mat.groups()
+                value = double
+                if value is None:
+                    value = single
+                    if value is None:
+                        value = unquoted or ''
+            else:
+                (key, value, comment) = mat.groups()
+            entries.append((key, value, comment, comment_list))
+        #
+        if initial_comment is not None:
+            self.initial_comment = initial_comment
+        for (key, value, comment, comments) in entries:
+            self.__setitem__(key, value, unrepr=True)
+            self.inline_comments[key] = comment
+            self.comments[key] = comments
+        if self.indent_type is None:
+            self.indent_type = ''
+        if not self and not self.initial_comment:
+            self.initial_comment = comment_list
+        elif not reset_comment:
+            self.final_comment = comment_list
+        return True
+
+
     def _match_depth(self, sect, depth):
         """
         Given a section and a depth level, walk back through the sections
@@ -2050,37 +2256,27 @@ class ConfigObj(Section):
 
     # Public methods
 
-    def write(self, outfile=None, section=None):
+    def _comment_lines(self, comments):
+        """Generate the lines of the initial or final comment."""
+        cs = self._a_to_u('#')
+        csp = self._a_to_u('# ')
+        for line in comments:
+            line = self._decode_element(line)
+            stripped_line = line.strip()
+            if stripped_line and not stripped_line.startswith(cs):
+                line = csp + line
+            yield line
+
+
+    def _section_lines(self, section):
         """
-        Write the current ConfigObj as a file
+        Generate the lines of a section and its subsections, for the write
+        method.
         
-        tekNico: FIXME: use StringIO instead of real files
-        
-        >>> filename = a.filename
-        >>> a.filename = 'test.ini'
-        >>> a.write()
-        >>> a.filename = filename
-        >>> a == ConfigObj('test.ini', raise_errors=True)
-        1
+        Values are written as they are, without interpolation.
         """
-        if self.indent_type is None:
-            # this can be true if initialised from a dictionary
-            self.indent_type = DEFAULT_INDENT_TYPE
-            
-        out = []
         cs = self._a_to_u('#')
         csp = self._a_to_u('# ')
-        if section is None:
-            int_val = self.interpolation
-            self.interpolation = False
-            section = self
-            for line in self.initial_comment:
-                line = self._decode_element(line)
-                stripped_line = line.strip()
-                if stripped_line and not stripped_line.startswith(cs):
-                    line = csp + line
-                out.append(line)
-                
         indent_string = self.indent_type * section.depth
         for entry in (section.scalars + section.sections):
             if entry in section.defaults:
@@ -2090,37 +2286,77 @@ class ConfigObj(Section):
                 comment_line = self._decode_element(comment_line.lstrip())
                 if comment_line and not comment_line.startswith(cs):
                     comment_line = csp + comment_line
-                out.append(indent_string + comment_line)
-            this_entry = section[entry]
+                yield indent_string + comment_line
+            this_entry = dict.__getitem__(section, entry)
             comment = self._handle_comment(section.inline_comments[entry])
             
             if isinstance(this_entry, dict):
                 # a section
-                out.append(self._write_marker(
+                yield self._write_marker(
                     indent_string,
                     this_entry.depth,
                     entry,
-                    comment))
-                out.extend(self.write(section=this_entry))
+                    comment)
+                for line in self._section_lines(this_entry):
+                    yield line
             else:
-                out.append(self._write_line(
+                yield self._write_line(
                     indent_string,
                     entry,
                     this_entry,
-                    comment))
-                
-        if section is self:
-            for line in self.final_comment:
-                line = self._decode_element(line)
-                stripped_line = line.strip()
-                if stripped_line and not stripped_line.startswith(cs):
-                    line = csp + line
-                out.append(line)
-            self.interpolation = int_val
+                    comment)
+
+
+    def _lines(self):
+        """Generate the lines of the file, without newlines or encoding."""
+        for line in self._comment_lines(self.initial_comment):
+            yield line
+        for line in self._section_lines(self):
+            yield line
+        for line in self._comment_lines(self.final_comment):
+            yield line
+
+
+    def write(self, outfile=None, section=None, atomic=False,
+              skip_unchanged=False):
+        """
+        Write the current ConfigObj as a file
+        
+        tekNico: FIXME: use StringIO instead of real files
+        
+        >>> filename = a.filename
+        >>> a.filename = 'test.ini'
+        >>> a.write()
+        >>> a.filename = filename
+        >>> a == ConfigObj('test.ini', raise_errors=True)
+        1
+        
+        With ``atomic`` the file is written as a temporary file in the same
+        directory, synced to disk and renamed over the file, so a crash leaves
+        either the old or the new file. The lines are streamed into the
+        temporary file rather than joined in memory first. With
+        ``skip_unchanged`` as well, the file is left alone (and keeps its
+        modification time) if its content would not change.
+        
+        >>> a.filename = 'test.ini'
+        >>> a.write(atomic=True)
+        >>> a.write(atomic=True, skip_unchanged=True)
+        >>> a.filename = filename
+        >>> a == ConfigObj('test.ini', raise_errors=True)
+        1
+        """
+        if self.indent_type is None:
+            # this can be true if initialised from a dictionary
+            self.indent_type = DEFAULT_INDENT_TYPE
             
-        if section is not self:
-            return out
+        if section is not None and section is not self:
+            return list(self._section_lines(section))
+        
+        if atomic and outfile is None and self.filename is not None:
+            self._write_atomic(skip_unchanged)
+            return
         
+        out = list(self._lines())
         if (self.filename is None) and (outfile is None):
             # output a list of lines
             # might need to encode
@@ -2154,6 +2390,65 @@ class ConfigObj(Section):
             h.close()
 
 
+    def _write_atomic(self, skip_unchanged):
+        """Write the file through a temporary file, see ``write``."""
+        import codecs, tempfile
+        newline = self._a_to_u(self.newlines or os.linesep)
+        encode = None
+        if self.encoding:
+            encode = codecs.getincrementalencoder(self.encoding)().encode
+        # the file a symlink points to is replaced, not the link
+        filename = os.path.realpath(self.filename)
+        fd, temp = tempfile.mkstemp(prefix=os.path.basename(filename) + '.',
+                                    suffix='.tmp',
+                                    dir=os.path.dirname(filename))
+        try:
+            h = os.fdopen(fd, 'wb')
+            try:
+                digest = _new_digest()
+                if self.BOM and ((self.encoding is None) or
+                                 match_utf8(self.encoding)):
+                    # Add the UTF8 BOM
+                    h.write(BOM_UTF8)
+                    digest.update(BOM_UTF8)
+                ends_with_newline = False
+                separator = ''
+                for line in self._lines():
+                    text = separator + line
+                    separator = newline
+                    if not text:
+                        continue
+                    ends_with_newline = text.endswith(newline)
+                    if encode is not None:
+                        text = encode(text)
+                    h.write(text)
+                    digest.update(text)
+                text = ''
+                if not ends_with_newline:
+                    text = newline
+                if encode is not None:
+                    text = encode(text, True)
+                h.write(text)
+                digest.update(text)
+                h.flush()
+                os.fsync(h.fileno())
+            finally:
+                h.close()
+            if skip_unchanged and _file_digest(filename) == digest.digest():
+                os.remove(temp)
+                return
+            try:
+                # keep the permissions of the file
+                os.chmod(temp, os.stat(filename).st_mode & 07777)
+            except OSError:
+                pass
+            _replace(temp, filename)
+        except:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+
     def validate(self, validator, preserve_errors=False, copy=False,
                  section=None):
         """
@@ -2220,7 +2515,12 @@ class ConfigObj(Section):
         ret_true = True
         ret_false = True
         order = [k for k in section._order if k in spec_section]
-        order += [k for k in spec_section if k not in order]
+        ordered = set(order)
+        order += [k for k in spec_section if k not in ordered]
+        if hasattr(validator, 'compile'):
+            ret_true, ret_false = self._validate_compiled(validator, section, order, out, copy,
+                                                         preserve_errors)
+            order = ()
         for entry in order:
             if entry == '__many__':
                 continue
@@ -2313,6 +2613,92 @@ class ConfigObj(Section):
         return out
 
 
+    def _validate_compiled(self, validator, section, order, out, copy,
+                           preserve_errors):
+        """
+        Check the scalars of a section with the compiled checks of a validator.
+        
+        Does what ``validate`` does for the scalars, in a single loop over the
+        compiled checks (see ``Validator.compile``) rather than a call of
+        ``check`` and ``get_default_value`` per value. Fills ``out`` and
+        returns ``(ret_true, ret_false)``.
+        """
+        compile = validator.compile
+        error_class = validator.baseErrorClass
+        spec_section = section.configspec
+        scalars = set(section.scalars)
+        defaults = section.defaults
+        from_defaults = set(defaults)
+        default_values = section.default_values
+        stringify = self.stringify
+        ret_true = True
+        ret_false = True
+        for entry in order:
+            if entry == '__many__':
+                continue
+            fun, has_default, default = compile(spec_section[entry])
+            missing = entry not in scalars or entry in from_defaults
+            if missing:
+                if copy and entry not in scalars:
+                    # copy comments
+                    section.comments[entry] = (
+                        section._configspec_comments.get(entry, []))
+                    section.inline_comments[entry] = (
+                        section._configspec_inline_comments.get(entry, ''))
+                if not has_default:
+                    out[entry] = False
+                    ret_true = False
+                    continue
+                val = None
+                value = default
+            else:
+                val = value = section[entry]
+            try:
+                if value is not None:
+                    value = fun(value)
+            except error_class, e:
+                if not preserve_errors:
+                    out[entry] = False
+                else:
+                    out[entry] = e
+                    ret_false = False
+                ret_true = False
+                continue
+            default_values.pop(entry, None)
+            if has_default:
+                if default is None:
+                    default_values[entry] = None
+                else:
+                    default_values[entry] = fun(default)
+            ret_false = False
+            out[entry] = True
+            if stringify or missing:
+                if not stringify:
+                    if isinstance(value, (list, tuple)):
+                        # preserve lists
+                        value = [self._str(item) for item in value]
+                    elif missing and value is None:
+                        # convert the None from a default to a ''
+                        value = ''
+                    else:
+                        value = self._str(value)
+                if missing:
+                    # __setitem__ takes it out of the defaults
+                    section[entry] = value
+                    from_defaults.discard(entry)
+                elif value != val:
+                    if stringify and not isinstance(value, dict):
+                        # replacing the value of an existing scalar
+                        dict.__setitem__(section, entry, value)
+                        section._changed()
+                    else:
+                        section[entry] = value
+            if not copy and missing and entry not in from_defaults:
+                defaults.append(entry)
+                from_defaults.add(entry)
+        return ret_true, ret_false
+
+
     def reset(self):
         """Clear ConfigObj instance and restore to 'freshly created' state."""
         self.clear()
@@ -0,0 +1,213 @@
+# Offline optimizer of the tracking deadband of koepelX
+#
+# Searches trackStartFraction, trackStopFraction and (in the sidereal and
+# extrapolate modes) trackLead for the fewest motor starts while the
+# telescope stays outside the slit for at most a given percentage of the
+# time, over recorded telescope tracks (see telescope.loadtrack).
+#
+# All parameter sets are simulated at once: the tracking logic of koepelX and
+# a dome with speed, spin-up, coast-down and relay latency are stepped in time
+# on numpy arrays holding one element per parameter set. The model steps in
+# fixed steps of --dt seconds and predicts the telescope with the sidereal
+# rate in both predictive modes; the best values can be checked afterwards
+# with the full simulation of trackbench.py.
+#
+#   python deadband.py --max-offslit 2 --write tracks/*.csv
+#
+# With --write the best values are written to the config file.
+
+import os, optparse, itertools, math
+import numpy as np
+from configobj import ConfigObj
+from validate import Validator
+import telescope, geometry
+
+PARAMETERS = ('trackStartFraction', 'trackStopFraction', 'trackLead')
+
+
+def _sidereal(az, alt, latitude, dt):
+    # telescope.sidereal on numpy arrays
+    az, alt, lat = np.radians(az), np.radians(alt), math.radians(latitude)
+    dec = np.arcsin(np.sin(alt) * math.sin(lat) + np.cos(alt) * math.cos(lat) * np.cos(az))
+    ha = np.arctan2(-np.sin(az) * np.cos(alt), math.cos(lat) * np.sin(alt) - math.sin(lat) * np.cos(alt) * np.cos(az))
+    ha = ha + np.radians(telescope.SIDEREAL * dt)
+    alt = np.arcsin(np.sin(dec) * math.sin(lat) + np.cos(dec) * math.cos(lat) * np.cos(ha))
+    az = np.arctan2(-np.sin(ha) * np.cos(dec), math.cos(lat) * np.sin(dec) - math.sin(lat) * np.cos(dec) * np.cos(ha))
+    return np.degrees(az) % 360., np.degrees(alt)
+
+
+def _wrap(angle):
+    return (angle + 180.) % 360. - 180.
+
+
+class Model(object):
+    # Tracking of koepelX on a dome model, vectorized over parameter sets
+
+    def __init__(self, cfg, speed=3., accel=2., decel=4., latency=0.05, dt=0.1):
+        self.cfg = cfg
+        self.opening = float(cfg['domeOpeningAngle'])
+        self.trackInterval = float(cfg['trackInterval'])
+        self.checkInterval = float(cfg['checkInterval'])
+        self.predictive = cfg['trackMode'] != 'reactive'
+        self.latitude = float(cfg['siteLatitude'])
+        self.geometry = geometry.fromconfig(cfg)
+        self.speed = speed
+        self.accel = accel
+        self.decel = decel
+        # A start is a push of clear and then of left or right, a stop only a push of clear
+        self.startDelay = float(cfg['pulseTime']) + latency
+        self.stopDelay = latency
+        self.dt = dt
+
+    def slit(self, track, times, ahead=0.):
+        # Slit azimuths at times for the telescope position predicted ahead seconds later
+        az = np.interp(times, track.times, track.az) % 360.
+        alt = np.interp(times, track.times, track.alt)
+        if ahead:
+            az, alt = _sidereal(az, alt, self.latitude, ahead)
+        return self.geometry.slitazs(az, alt)
+
+    def run(self, track, starts, stops, leads):
+        # Simulate a track for arrays of parameters
+        # Returns arrays of the percentage of time off the slit, the number of
+        # motor starts and the dome travel in degrees
+        times = np.arange(0., track.duration(), self.dt)
+        now = self.slit(track, times)
+        if self.predictive:
+            upcoming = self.slit(track, times, self.trackInterval)
+            values = sorted(set(leads))
+            aims = dict((lead, self.slit(track, times, lead)) for lead in values)
+        n = len(starts)
+        startAngle = np.asarray(starts) * self.opening
+        stopAngle = np.asarray(stops) * self.opening
+        leads = np.asarray(leads)
+
+        position = np.full(n, now[0])
+        velocity = np.zeros(n)
+        target = np.zeros(n)                # Velocity the motor is heading for
+        pendingTime = np.full(n, np.inf)    # Time a pushed button takes effect
+        pendingTarget = np.zeros(n)
+        direction = np.zeros(n)             # -1 moving left, 1 moving right, 0 standing still
+        nextCheck = np.zeros(n)
+        starts = np.zeros(n, dtype=int)
+        travel = np.zeros(n)
+        outside = np.zeros(n, dtype=int)
+        half = 0.5 * self.opening
+
+        for k, t in enumerate(times):
+            # Dome
+            due = pendingTime <= t
+            target = np.where(due, pendingTarget, target)
+            pendingTime = np.where(due, np.inf, pendingTime)
+            faster = (target * velocity >= 0) & (np.abs(target) > np.abs(velocity))
+            rate = np.where(faster, self.accel, self.decel) * self.dt
+            velocity = velocity + np.clip(target - velocity, -rate, rate)
+            position = position + velocity * self.dt
+            travel += np.abs(velocity) * self.dt
+            offset = _wrap(now[k] - position)
+            outside += np.abs(offset) > half
+
+            # Tracking, see Movement._track_ and Movement._trackahead_ of koepelX
+            check = t >= nextCheck
+            if self.predictive:
+                nextOffset = _wrap(upcoming[k] - position)
+                aim = np.choose(np.searchsorted(values, leads), [aims[lead][k] for lead in values])
+                aimOffset = nextOffset + np.clip(_wrap(aim - upcoming[k]), -stopAngle, stopAngle)
+                start = check & (direction == 0) & (np.abs(nextOffset) > startAngle)
+                towards = np.where(aimOffset < 0, -1., 1.)
+                stop = check & ~start & (direction != 0) & (direction * aimOffset <= 0)
+            else:
+                towards = np.sign(offset)
+                start = check & (np.abs(offset) > startAngle) & (direction != towards)
+                stop = check & ~start & (direction != 0) & (direction * offset < -stopAngle)
+            starts += start
+            pendingTime = np.where(start, t + self.startDelay, np.where(stop, t + self.stopDelay, pendingTime))
+            pendingTarget = np.where(start, towards * self.speed, np.where(stop, 0., pendingTarget))
+            direction = np.where(start, towards, np.where(stop, 0., direction))
+            nextCheck = np.where(check, t + np.where(direction != 0, self.checkInterval, self.trackInterval), nextCheck)
+
+        return 100. * outside / float(len(times)), starts, travel
+
+
+def search(model, tracks, starts, stops, leads):
+    # Results of all combinations of the parameter values over all tracks
+    # Returns the parameter arrays and the off-slit percentage (weighted by
+    # the length of the tracks), motor starts and travel per combination
+    if not model.predictive:
+        leads = [0.]
+    grid = np.array(list(itertools.product(starts, stops, leads)), dtype=float)
+    offslit = np.zeros(len(grid))
+    cycles = np.zeros(len(grid), dtype=int)
+    travel = np.zeros(len(grid))
+    duration = 0.
+    for track in tracks:
+        o, c, d = model.run(track, grid[:, 0], grid[:, 1], grid[:, 2])
+        offslit += o * track.duration()
+        cycles += c
+        travel += d
+        duration += track.duration()
+    return grid, offslit / duration, cycles, travel
+
+
+def best(grid, offslit, cycles, maxOffslit):
+    # Index of the combination with the fewest motor starts within maxOffslit,
+    # the least time off the slit breaks ties. None if no combination is within.
+    feasible = np.nonzero(offslit <= maxOffslit)[0]
+    if len(feasible) == 0:
+        return None
+    return feasible[np.lexsort((offslit[feasible], cycles[feasible]))[0]]
+
+
+def _values(text):
+    return [float(value) for value in text.split(',')]
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] track [track ...]')
+    parser.add_option('--config', default='config.ini', help='config file of koepelX [%default]')
+    parser.add_option('--max-offslit', type='float', default=2., help='maximum percentage of time off the slit [%default]')
+    parser.add_option('--starts', default='0.2,0.25,0.3,0.35,0.4,0.45,0.5', help='values of trackStartFraction [%default]')
+    parser.add_option('--stops', default='-0.2,-0.1,0,0.1,0.2,0.3,0.4,0.45', help='values of trackStopFraction [%default]')
+    parser.add_option('--leads', default='0,60,120,300,600', help='values of trackLead, in the predictive modes [%default]')
+    parser.add_option('--dt', type='float', default=0.1, help='time step of the model in seconds [%default]')
+    parser.add_option('--speed', type='float', default=3., help='dome speed in degrees/s [%default]')
+    parser.add_option('--accel', type='float', default=2., help='spin-up in degrees/s^2 [%default]')
+    parser.add_option('--decel', type='float', default=4., help='coast-down in degrees/s^2 [%default]')
+    parser.add_option('--latency', type='float', default=0.05, help='relay latency in seconds [%default]')
+    parser.add_option('--write', action='store_true', help='write the best values to the config file')
+    options, paths = parser.parse_args()
+    if not paths:
+        parser.error('no tracks given')
+
+    cfg = ConfigObj(options.config, configspec=os.path.join(os.path.dirname(options.config), 'configspec.ini'))
+    cfg.validate(Validator())
+    model = Model(cfg, options.speed, options.accel, options.decel, options.latency, options.dt)
+    tracks = [telescope.loadtrack(path) for path in paths]
+    grid, offslit, cycles, travel = search(model, tracks, _values(options.starts), _values(options.stops), _values(options.leads))
+
+    print('%-18s %-17s %-9s %8s %7s %9s' % (PARAMETERS + ('offslit', 'cycles', 'travel')))
+    for i in np.lexsort((offslit, cycles))[:10]:
+        print('%-18.2f %-17.2f %-9.0f %7.2f%% %7d %9.1f' % (tuple(grid[i]) + (offslit[i], cycles[i], travel[i])))
+
+    i = best(grid, offslit, cycles, options.max_offslit)
+    if i is None:
+        print('No values keep the telescope off the slit for at most %.2f%% of the time' % options.max_offslit)
+        return
+    values = dict(zip(PARAMETERS, grid[i]))
+    if not model.predictive:
+        del values['trackLead']
+    print('Best: %s (%.2f%% off the slit, %d motor starts)' %
+          (', '.join('%s = %g' % item for item in sorted(values.items())), offslit[i], cycles[i]))
+
+    if options.write:
+        # Only the values are changed, the comments of the file are kept. The
+        # file is replaced at once, so a running koepelX never reads half of it
+        config = ConfigObj(options.config)
+        for key, value in values.items():
+            config[key] = '%g' % value
+        config.write(atomic=True, skip_unchanged=True)
+        print('Written to %s' % options.config)
+
+
+if __name__ == '__main__':
+    main()
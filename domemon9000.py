@@ -4,9 +4,6 @@ import matplotlib
 matplotlib.use('wxagg')
 import matplotlib.pyplot as plt
 import time
-import win32com.client
-import pythoncom
-import sys
 
 HOST = 'Hercules'
 PORT = 65000
@@ -15,31 +12,19 @@ ADDR = (HOST, PORT)
 
 slit_size = 5.
 
-sys.coinit_flags = 0
-pythoncom.CoInitialize()    
-ObjTele = win32com.client.Dispatch("TheSkyXAdaptor.RASCOMTele")
-ObjTele.Connect()
-    
 while 1:
 
+    # The dome controller reads the telescope, STATUS returns its latest reading
+    # together with the dome: position busy azimuth altitude age
     tcpCliSock = socket(AF_INET, SOCK_STREAM)
     tcpCliSock.connect(ADDR)
-    tcpCliSock.send('POSITION')
-    POPO = tcpCliSock.recv(BUFSIZ)
-    position = float(POPO.split('\n')[0])
-    if position < 0.: position = position + 360.
-    if position > 360.: position = position % 360.
-    tcpCliSock.close()
-
-    tcpCliSock = socket(AF_INET, SOCK_STREAM)
-    tcpCliSock.connect(ADDR)
-    tcpCliSock.send('DOMEBUSY')
-    DOSO = tcpCliSock.recv(BUFSIZ)
-    dome_status = int(DOSO.split('\n')[0])
+    tcpCliSock.send('STATUS')
+    STAT = tcpCliSock.recv(BUFSIZ)
     tcpCliSock.close()
-
-    ObjTele.GetAzAlt()   
-    scope_az = ObjTele.dAz
+    position, dome_status, scope_az = STAT.split('\n')[0].split()[:3]
+    position = float(position) % 360.
+    dome_status = int(dome_status)
+    scope_az = float(scope_az)
 
     theta = np.arange((position-(slit_size/2.))/180.*np.pi,(position+(slit_size/2.))/180.*np.pi,0.01)
     r = [1.] * len(theta)
@@ -0,0 +1,95 @@
+# Geometry of the telescope in the dome
+#
+# With a German equatorial mount the optical axis does not pass through the
+# middle of the dome: the crossing of the RA and declination axes can be off
+# the middle of the dome, and the tube is offset from the RA axis along the
+# declination axis, on the east or west side of the pier. In a small dome the
+# slit then has to be at another azimuth than the telescope points to, most of
+# all at high altitudes.
+#
+# The slit azimuth is found where the optical axis leaves the dome, taken as
+# a sphere of domeRadius around the middle of the dome. Positions are in
+# metres, x to the east, y to the north and z up from the middle of the dome.
+# Without offsets the slit azimuth equals the telescope azimuth.
+#
+# The point where the optical axis leaves the dome is computed directly, with
+# the math module for a tracking update and elementwise with numpy for arrays
+# of positions (slitazs).
+
+import math
+
+
+class DomeGeometry(object):
+    # Slit azimuth for a telescope azimuth and altitude
+    # mount is the crossing of the RA and declination axes (x, y, z),
+    # decOffset the distance from the RA axis to the optical axis and
+    # pierSide the side of the pier the tube is on: 'east', 'west' or 'auto'
+    # (east when pointing west of the meridian, west otherwise).
+
+    def __init__(self, radius, mount=(0., 0., 0.), decOffset=0., latitude=53.24, pierSide='auto'):
+        self.radius = radius
+        self.mount = mount
+        self.decOffset = decOffset
+        self.latitude = latitude
+        self.pierSide = pierSide
+        self.identity = not any(mount) and decOffset == 0
+
+    def side(self, az):
+        # +1 when the tube is on the east side of the pier, -1 when on the west side
+        if self.pierSide == 'east':
+            return 1
+        if self.pierSide == 'west':
+            return -1
+        # The hour angle is positive (west of the meridian) for azimuths between 180 and 360 degrees
+        return 1 if az % 360. >= 180. else -1
+
+    def slitaz(self, az, alt):
+        # Azimuth of the slit for the telescope at az, alt (degrees)
+        if self.identity:
+            return az
+        x, y = self.evaluate(math, az, alt, self.side(az))
+        return math.degrees(math.atan2(x, y)) % 360.
+
+    def slitazs(self, az, alt):
+        # Slit azimuths for numpy arrays of azimuths and altitudes, computed directly
+        import numpy as np
+        az, alt = np.asarray(az, dtype=float), np.asarray(alt, dtype=float)
+        if self.identity:
+            return az % 360.
+        if self.pierSide == 'auto':
+            side = np.where(az % 360. >= 180., 1, -1)
+        else:
+            side = self.side(0.)
+        x, y = self.evaluate(np, az, alt, side)
+        return np.degrees(np.arctan2(x, y)) % 360.
+
+    def evaluate(self, m, az, alt, side):
+        # East and north position where the optical axis leaves the dome for
+        # az, alt in degrees and a side of the pier, computed with the math
+        # module or elementwise on arrays with numpy
+        az, alt, lat = m.radians(az), m.radians(alt), math.radians(self.latitude)
+        # Pointing direction and RA axis
+        lx, ly, lz = m.sin(az) * m.cos(alt), m.cos(az) * m.cos(alt), m.sin(alt)
+        ax, ay, az_ = 0., math.cos(lat), math.sin(lat)
+        # Declination axis, perpendicular to both
+        dx, dy, dz = ay * lz - az_ * ly, az_ * lx - ax * lz, ax * ly - ay * lx
+        norm = m.sqrt(dx * dx + dy * dy + dz * dz)
+        # Pointing at the pole the declination axis can have any direction
+        norm = norm + (norm < 1e-12)
+        offset = side * self.decOffset / norm
+        # Point on the optical axis
+        ox = self.mount[0] + offset * dx
+        oy = self.mount[1] + offset * dy
+        oz = self.mount[2] + offset * dz
+        # Distance along the optical axis to the dome
+        b = ox * lx + oy * ly + oz * lz
+        c = ox * ox + oy * oy + oz * oz - self.radius * self.radius
+        t = -b + m.sqrt(b * b - c)
+        return ox + t * lx, oy + t * ly
+
+
+def fromconfig(cfg):
+    # Geometry of the dome with the values of the config
+    return DomeGeometry(float(cfg['domeRadius']),
+                        (float(cfg['mountEast']), float(cfg['mountNorth']), float(cfg['mountUp'])),
+                        float(cfg['decAxisOffset']), float(cfg['siteLatitude']), cfg['pierSide'])
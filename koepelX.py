@@ -1,97 +1,130 @@
-import threading, time, socket, logging, Queue, sys, win32com.client
-from configobj import ConfigObj
-from validate import Validator
+import time
+loadStart = time.time()
+import threading, socket, logging, Queue, sys, os
+import telemetry, tracing, relay, ports, clock, telescope, geometry, settings
+loadTime = time.time() - loadStart  # Time taken by the imports, reported at startup (see main)
+
+# Importing this module has no side effects: the config is read, the hardware opened and the
+# threads started by main(). configobj, validate and the COM modules of the telescope are only
+# imported when they are used.
 
 # Used globals
-currentPos = 0.0                  # Starting position
-domeBusy = False                # Boolean for movement of dome
 configfile = 'config.ini'       # Config file
 configspecfile = 'configspec.ini' # Config file specification
-calibrating = False             # Indicator if the current state is 'calibrating'
+Domes = []                      # Controllers of the domes, commands without a dome name go to the first
 
-# Read and write functions are defined here
-# For usage with a different library or os, only the section below needs to be modified to access the printerport in a proper way
-# pportWrite(portaddress, value)
-# pportRead(portaddress)
-from ctypes import windll
-pportWrite = windll.inpoutx64.DlPortWritePortUchar
-pportRead = windll.inpoutx64.DlPortReadPortUchar
+# Keys of the config per subsystem, notified when they change while running (see settings.py)
+ENCODERKEYS = ('statusReg', 'ctrlReg', 'bitA', 'bitB', 'zeroBit', 'invDirection')
+TRACKINGKEYS = ('trackStartFraction', 'trackStopFraction', 'domeOpeningAngle', 'pulsesPerDegree')
+SERVERKEYS = ('serverPort', 'maxConnections')
+GEOMETRYKEYS = ('domeRadius', 'mountEast', 'mountNorth', 'mountUp', 'decAxisOffset', 'siteLatitude', 'pierSide')
+TELESCOPEKEYS = ('telescopeSource', 'telescopeFile', 'telescopeHost', 'telescopePort', 'telescopeInterval', 'telescopeRetry')
+RESTARTKEYS = ('logfile', 'maxQueueSize', 'clientThreads', 'telemetryDir', 'traceFile')
+DOMERESTARTKEYS = ('portBackend', 'portDevice', 'simSpeed', 'currentPosFile', 'trackHistory')
 
 class Position(threading.Thread):
 # Class used for the tracking of the position of the dome
     lastActivity = -1           # Time of last activity, start inactive
 
+    def __init__(self, dome, name='Position'):
+        threading.Thread.__init__(self, name=name)
+        self.dome = dome
+        self.configure()
+        dome.watcher.subscribe(ENCODERKEYS, self.configure)
+    
+    def configure(self, changed=()):
+        # Register and bit masks of the encoder, taken over by the reading loop in one go
+        dome = self.dome
+        self.encoder = (dome.settings.statusReg, dome.settings.bitA, dome.settings.bitB, dome.settings.zeroBit, int(dome.settings.invDirection)*2 - 1)
+        if 'ctrlReg' in changed:
+            dome.port.write(dome.settings.ctrlReg, 12) # Set data register to output mode
+
     def run(self):
     # Main function for measuring the pulses from rotary encoder. 
     # Also auto-calibrates when passing zeroPoint
     
-            # Used global parameters
-            global cfg
-            global currentPos
-            global calibrating
+            dome = self.dome
+            pportWrite, pportRead = dome.port.write, dome.port.read
             
             lastWrittenPos = 0          # Last position written to file
+            lastWriteTime = Clock.now() # Time of the last write of the position file
             
-            pportWrite(int(cfg['ctrlReg']), 12) # Set data register to output mode
-            statregold = pportRead(int(cfg['statusReg'])) # Last status of port
+            pportWrite(dome.settings.ctrlReg, 12) # Set data register to output mode
+            statregold = pportRead(dome.settings.statusReg) # Last status of port
             
             # Reading current position from file
-            f = open(cfg['currentPosFile'], mode='r+')
+            f = open(dome.settings.currentPosFile, mode='r+')
             try:
                 tmp = f.read()
                 if tmp == '':
                     # Catch the case when file is empty
-                    currentPos = float(cfg['zeroAngle']) * float(cfg['pulsesPerDegree'])
-                    logging.error('Empty positioning-file. Current position defined as zeroAngle (%s).' % (float(cfg['zeroAngle']),))
+                    dome.currentPos = dome.settings.zeroAngle * dome.settings.pulsesPerDegree
+                    logging.error('Empty positioning-file. Current position defined as zeroAngle (%s).' % (dome.settings.zeroAngle,))
                 else:
-                    currentPos = float(tmp)
-                    lastWrittenPos = currentPos
+                    dome.currentPos = float(tmp)
+                    lastWrittenPos = dome.currentPos
             except (IOError, ValueError):
                 # In case of reading a string or IOerror, truncate file and define position as zeroAngle
                 f.seek(0)
                 f.truncate()
-                currentPos = float(cfg['zeroAngle']) * float(cfg['pulsesPerDegree'])
-                logging.error('Invalid positioning-file. Current position defined as zeroAngle (%s).' % (float(cfg['zeroAngle']),))
+                dome.currentPos = dome.settings.zeroAngle * dome.settings.pulsesPerDegree
+                logging.error('Invalid positioning-file. Current position defined as zeroAngle (%s).' % (dome.settings.zeroAngle,))
             
+            encoder = None
             try:
                 while 1:
-                    statreg = pportRead(int(cfg['statusReg']))
+                    if self.encoder is not encoder:
+                        encoder = self.encoder
+                        statusReg, bitA, bitB, zeroBit, direction = encoder
+                    statreg = pportRead(statusReg)
 
-                    if ((statreg & int(cfg['bitA'])) and (~statregold & int(cfg['bitA']))):
+                    if ((statreg & bitA) and (~statregold & bitA)):
                         # New pulse
-                        self.lastActivity = time.clock()
-                        currentPos += ((statreg & int(cfg['bitB']))/int(cfg['bitB'])*2 - 1) * (int(cfg['invDirection'])*2 - 1)
+                        self.lastActivity = Clock.now()
+                        dome.currentPos += ((statreg & bitB)/bitB*2 - 1) * direction
+                        if Trace.firstPulse:
+                            Trace.pulse(dome.name)
 			
                     
                     statregold = statreg
 
-                    if not (statreg & int(cfg['zeroBit'])):
+                    if not (statreg & zeroBit):
                         # Zero point has been reached
-                        if calibrating:
+                        if dome.calibrating:
                             # stop calibration if calibration is in progress
-                            calibrating = False 
+                            dome.calibrating = False 
 #                        elif cfg["autoCalibrate"]:
 #                            currentPos = float(cfg['zeroAngle']) * float(cfg['pulsesPerDegree'])
 #			    print('DANGER SETB AT AUTOCLAIB POSITION')
                     
-                    if time.clock() - self.lastActivity < float(cfg['activeTime']):
+                    now = Clock.now()
+                    if now - self.lastActivity < dome.settings.activeTime:
                         # Active; high processor usage
-                        time.sleep(float(cfg['sleepTimeAct']))
+                        # While moving the file is written every posWriteInterval seconds, so a
+                        # koepelX restarted by the supervisor starts close to the real position
+                        if 0 < dome.settings.posWriteInterval < now - lastWriteTime and lastWrittenPos != dome.currentPos:
+                            f.seek(0)
+                            f.truncate()
+                            f.write(str(dome.currentPos))
+                            f.flush()
+                            lastWrittenPos = dome.currentPos
+                            lastWriteTime = now
+                        Clock.sleep(dome.settings.sleepTimeAct)
                     else:
                         # Passive; low processor usage
-                        if lastWrittenPos != currentPos:
+                        if lastWrittenPos != dome.currentPos:
                             # Write to file
                             f.seek(0)
                             f.truncate()
-                            f.write(str(currentPos))
+                            f.write(str(dome.currentPos))
                             f.flush()
-                            lastWrittenPos = currentPos
+                            lastWrittenPos = dome.currentPos
                             
-                        time.sleep(float(cfg['sleepTimePas']))
+                        Clock.sleep(dome.settings.sleepTimePas)
             except:
                 # Write mose recent value and close position-file in case of exception
                 f.truncate(0)
-                f.write(str(currentPos))
+                f.write(str(dome.currentPos))
                 f.flush()
                 f.close()
                 logging.error("Error in reading port, class Position closed")
@@ -99,7 +132,7 @@ class Position(threading.Thread):
 
     def makeActive(self):
         # Make the current position reading state active
-        self.lastActivity = time.clock()
+        self.lastActivity = Clock.now()
     
 class Movement(threading.Thread):
     # Movement functions: tracking, goto, calibrate, left, right, clearmove.
@@ -107,93 +140,121 @@ class Movement(threading.Thread):
 
     nextAction = ''
     nextPosition = 0
+    nextRequest = None          # Traced request of the next action
+    requestTime = 0             # Time the next action was requested
+    
+    def __init__(self, dome, name='Movement'):
+        threading.Thread.__init__(self, name=name)
+        self.dome = dome
+        self.wakeup = Clock.event()     # Set when a next action is given
+        self.configure()
+    
+    def configure(self, changed=()):
+        # Thresholds of tracking, in degrees from the middle of the dome opening and
+        # as the difference in pulses of the reactive loop (see _track_)
+        dome = self.dome
+        ppd = dome.settings.pulsesPerDegree
+        self.startAngle = dome.settings.trackStartFraction * dome.settings.domeOpeningAngle
+        self.stopAngle = dome.settings.trackStopFraction * dome.settings.domeOpeningAngle
+        self.startLeft = (180. - self.startAngle) * ppd
+        self.startRight = (180. + self.startAngle) * ppd
+        self.stopLeft = (180. + self.stopAngle) * ppd
+        self.stopRight = (180. - self.stopAngle) * ppd
     
     def track(self):
         # Tracking the telescope using COM-interface of TheSky
         
-        global domeBusy
+        dome = self.dome
         
-        if domeBusy:
+        if dome.domeBusy:
             return 0
         else:
+            self.request()
             self.nextAction='track'
+            self.wakeup.set()
             return 1
     
     def _track_(self):
-        global domeBusy
-        global currentPos
-        global cfg
-        global ObjTele
+        dome = self.dome
         
-        domeBusy = True
-        
-        # Python Com-interface needs to be re-initialized for seperate thread
-        import pythoncom
-        sys.coinit_flags = 0
-        pythoncom.CoInitialize()
+        dome.domeBusy = True
         
         logging.info("Tracking telescope.")
-        oldPos = currentPos
-        tmpTime = time.clock()
+        oldPos = dome.currentPos
+        tmpTime = Clock.now()
 
-        ObjTele = win32com.client.Dispatch("TheSkyXAdaptor.RASCOMTele")
-        
-        try:
-            ObjTele.Connect()
-        except:
+        # Wait for a reading of the telescope poller
+        deadline = Clock.now() + dome.settings.telescopeTimeout
+        while dome.slitaz() is None and Clock.now() < deadline:
+            Clock.waituntil(min(Clock.now() + dome.settings.checkInterval, deadline))
+        if dome.slitaz() is None:
             logging.error("Cannot connect to telescope.")
-            domeBusy = False
-            
-        if ObjTele.IsConnected == 0:
-            domeBusy = False
+            dome.domeBusy = False
         
         movingLeft = False
         movingRight = False
+        deadline = Clock.now()
             
-        while domeBusy:
-            try:
-                # Get Azimuth angle of telescope
-                ObjTele.GetAzAlt()
-            except:
+        while dome.domeBusy:
+            # Predictive tracking, returns when trackMode is changed back to reactive
+            if dome.settings.trackMode != 'reactive':
+                if movingLeft or movingRight:
+                    self.clearmove(keepBusyState = True)
+                self._trackahead_()
+                movingLeft = False
+                movingRight = False
+                deadline = Clock.now()
+                continue
+            
+            # Go straight to the end of a slew of the telescope
+            if self._slew_():
+                movingLeft = False
+                movingRight = False
+                deadline = Clock.now()
+                continue
+            
+            # Get Azimuth angle of telescope, as seen through the slit
+            az = dome.slitaz()
+            if az is None:
                 logging.error("Connection to telescope lost.")
-                domeBusy = False
+                dome.domeBusy = False
                 break
             
             # calculate difference between telescope and dome opening (middle)
-            dif = ((180. + ObjTele.dAz) * float(cfg['pulsesPerDegree']) - currentPos) % (360. * float(cfg['pulsesPerDegree']))
+            dif = ((180. + az) * dome.settings.pulsesPerDegree - dome.currentPos) % (360. * dome.settings.pulsesPerDegree)
     
-            if (dif < (180. - 0.5 * float(cfg['domeOpeningAngle'])) * float(cfg['pulsesPerDegree']) and not movingLeft):
+            if (dif < self.startLeft and not movingLeft):
                 # Move to left
                 self.clearmove(keepBusyState = True)
                 self.setleft(isTracking = True)
                 movingLeft = True
                 movingRight = False
-                oldTime = time.clock()
-                oldPos = currentPos
+                oldTime = Clock.now()
+                oldPos = dome.currentPos
                 
-            if (dif > (180. + 0.5 * float(cfg['domeOpeningAngle'])) * float(cfg['pulsesPerDegree']) and not movingRight):
+            if (dif > self.startRight and not movingRight):
                 # Move to right
                 self.clearmove(keepBusyState = True)
                 self.setright(isTracking = True)
                 movingRight = True
                 movingLeft = False
-                oldTime = time.clock()
-                oldPos = currentPos
+                oldTime = Clock.now()
+                oldPos = dome.currentPos
             
             # check movement of dome to left
             if movingLeft:
-                if (time.clock() - oldTime > float(cfg['moveTimeout'])):
-                    if (oldPos == currentPos):
+                if (Clock.now() - oldTime > dome.settings.moveTimeout):
+                    if (oldPos == dome.currentPos):
                         # Raise error
                         logging.error("Timeout occured in moving dome.")
-                        domeBusy = False
+                        dome.domeBusy = False
                         break
                     else:
-                        oldTime = time.clock()
-                        oldPos = currentPos
+                        oldTime = Clock.now()
+                        oldPos = dome.currentPos
                 
-                # wait for telescope tot arrive at lefthandside of dome opening
-                if (dif > (180. - 0.55 * float(cfg['domeOpeningAngle'])) * float(cfg['pulsesPerDegree'])):
+                # wait for telescope tot arrive at righthandside of dome opening
+                if (dif > self.stopLeft):
                     logging.info("Dome followed telecope")
                     movingLeft = False
                     movingRight = False
@@ -201,18 +262,18 @@ class Movement(threading.Thread):
                     
             # check movement of dome to left
             if movingRight:
-                if (time.clock() - oldTime > float(cfg['moveTimeout'])):
-                    if (oldPos == currentPos):
+                if (Clock.now() - oldTime > dome.settings.moveTimeout):
+                    if (oldPos == dome.currentPos):
                         # Raise error
                         logging.error("Timeout occured in moving dome.")
-                        domeBusy = False
+                        dome.domeBusy = False
                         break
                     else:
-                        oldTime = time.clock()
-                        oldPos = currentPos
+                        oldTime = Clock.now()
+                        oldPos = dome.currentPos
                         
                 # wait for telescope tot arrive at lefthandside of dome opening
-                if (dif < (180. - 0.45 * float(cfg['domeOpeningAngle'])) * float(cfg['pulsesPerDegree'])):
+                if (dif < self.stopRight):
                     logging.info("Dome followed telecope")
                     movingLeft = False
                     movingRight = False
@@ -220,144 +281,283 @@ class Movement(threading.Thread):
             
             # set measuring timeout
             if movingLeft or movingRight:
-                time.sleep(float(cfg['checkInterval']))
+                deadline += dome.settings.checkInterval
+            else:
+                deadline += dome.settings.trackInterval
+            Clock.waituntil(deadline)
+
+    def _trackahead_(self):
+        # Tracking ahead of the telescope with a predicted azimuth (trackMode sidereal or extrapolate)
+        # The dome starts moving when the telescope would leave the opening before the next
+        # check, and stops with the middle of the opening where the telescope will be after
+        # trackLead seconds. The telescope then crosses the opening before the next correction.
+        # The middle is kept within trackStopFraction times the opening from the telescope, so
+        # the telescope is inside the opening when the dome stops.
+        # Returns when trackMode is changed to reactive while tracking.
+        dome = self.dome
+        
+        ppd = dome.settings.pulsesPerDegree
+        direction = 0                   # -1 moving left, 1 moving right, 0 standing still
+        deadline = Clock.now()
+        
+        while dome.domeBusy and dome.settings.trackMode != 'reactive':
+            # Go straight to the end of a slew of the telescope
+            if self._slew_():
+                direction = 0
+                deadline = Clock.now()
+                continue
+            
+            nextAz = dome.slitaz(dome.settings.trackInterval)
+            aim = dome.slitaz(dome.settings.trackLead)
+            if nextAz is None or aim is None:
+                logging.error("Connection to telescope lost.")
+                dome.domeBusy = False
+                break
+            
+            # angles from the middle of the dome opening, positive to the right
+            nextOffset = (nextAz - dome.currentPos / ppd + 180.) % 360. - 180.
+            lead = min(max((aim - nextAz + 180.) % 360. - 180., -self.stopAngle), self.stopAngle)
+            aimOffset = nextOffset + lead
+            
+            if direction == 0 and abs(nextOffset) > self.startAngle:
+                self.clearmove(keepBusyState = True)
+                if aimOffset < 0:
+                    self.setleft(isTracking = True)
+                    direction = -1
+                else:
+                    self.setright(isTracking = True)
+                    direction = 1
+                oldTime = Clock.now()
+                oldPos = dome.currentPos
+            
+            if direction != 0:
+                if (Clock.now() - oldTime > dome.settings.moveTimeout):
+                    if (oldPos == dome.currentPos):
+                        # Raise error
+                        logging.error("Timeout occured in moving dome.")
+                        dome.domeBusy = False
+                        break
+                    else:
+                        oldTime = Clock.now()
+                        oldPos = dome.currentPos
+                
+                # wait for the middle of the dome opening to arrive at the predicted azimuth
+                if direction * aimOffset <= 0:
+                    logging.info("Dome followed telecope")
+                    direction = 0
+                    self.clearmove(keepBusyState = True)
+            
+            # set measuring timeout
+            if direction != 0:
+                deadline += dome.settings.checkInterval
             else:
-                time.sleep(float(cfg['trackInterval']))
+                deadline += dome.settings.trackInterval
+            Clock.waituntil(deadline)
         
-        # Uninitialize Com interface
-        pythoncom.CoUninitialize()
+        if direction != 0 and dome.domeBusy:
+            self.clearmove(keepBusyState = True)
+
+    def _slew_(self):
+        # Move the dome the shortest way to where a slew of the telescope ends (see slewTarget)
+        # Returns False when the telescope is not slewing or the slit is already near the end
+        # of the slew, otherwise returns once the dome is at the end of the slew with the
+        # telescope stopped, or at a telescope which stopped without a known destination.
+        dome = self.dome
+        
+        ppd = dome.settings.pulsesPerDegree
+        startAngle = self.startAngle
+        end = dome.slewtarget()
+        if end is None or abs((end - dome.currentPos / ppd + 180.) % 360. - 180.) <= startAngle:
+            return False
+        
+        logging.info("Telescope slewing, moving dome to %.2f" % end)
+        direction = 0                   # -1 moving left, 1 moving right, 0 standing still
+        deadline = Clock.now()
+        while dome.domeBusy:
+            end = dome.slewtarget()
+            if end is None:
+                # The slew is over, the dome moves on to the telescope
+                end = dome.slitaz()
+                if end is None or direction == 0:
+                    break
+            
+            # angle from the middle of the dome opening, positive to the right
+            offset = (end - dome.currentPos / ppd + 180.) % 360. - 180.
+            
+            if direction != 0 and direction * offset <= 0:
+                direction = 0
+                self.clearmove(keepBusyState = True)
+            
+            if direction == 0 and abs(offset) > startAngle:
+                self.clearmove(keepBusyState = True)
+                if offset < 0:
+                    self.setleft(isTracking = True)
+                    direction = -1
+                else:
+                    self.setright(isTracking = True)
+                    direction = 1
+                oldTime = Clock.now()
+                oldPos = dome.currentPos
+            
+            if direction != 0 and Clock.now() - oldTime > dome.settings.moveTimeout:
+                if (oldPos == dome.currentPos):
+                    # Raise error
+                    logging.error("Timeout occured in moving dome.")
+                    dome.domeBusy = False
+                    break
+                else:
+                    oldTime = Clock.now()
+                    oldPos = dome.currentPos
+            
+            deadline += dome.settings.checkInterval
+            Clock.waituntil(deadline)
+        
+        if direction != 0 and dome.domeBusy:
+            self.clearmove(keepBusyState = True)
+        logging.info("Dome followed slew of telescope")
+        return True
 
     def goto(self, position):
         # Goto function for telescope to rotate to a given angle
         # [x] Error checking on degree number
-        global domeBusy
+        dome = self.dome
         
-        if domeBusy:
+        if dome.domeBusy:
             return 0
         else:
+            self.request()
             self.nextPosition=position
             self.nextAction='goto'
+            self.wakeup.set()
             return 1
         
+    def request(self):
+        # Remember the request of the calling (client) thread for the next action
+        self.nextRequest = Trace.request()
+        self.requestTime = Trace.now()
+        Trace.begin('move')
+        
     def _goto_(self, position):
-        global domeBusy
-        global currentPos
-        global cfg
+        dome = self.dome
         
-        logging.info("Moving from degree %s to %s" % (currentPos/float(cfg['pulsesPerDegree']),position))
-        oldPos = currentPos
-        tmpTime = time.clock()
+        logging.info("Moving from degree %s to %s" % (dome.currentPos/dome.settings.pulsesPerDegree,position))
+        oldPos = dome.currentPos
+        tmpTime = Clock.now()
         
-        if (currentPos / float(cfg['pulsesPerDegree']) - position) % 360. < 180.:
+        if (dome.currentPos / dome.settings.pulsesPerDegree - position) % 360. < 180.:
             # Move left
             self.setleft()
             
             # Loop till dome has reached given position
-            while (currentPos - position * float(cfg['pulsesPerDegree'])) % (360. * float(cfg['pulsesPerDegree'])) < 180. * float(cfg['pulsesPerDegree']) and domeBusy:
-                time.sleep(float(cfg['checkInterval']))
-                if (time.clock() - tmpTime > float(cfg['moveTimeout'])):
-                    if (oldPos == currentPos):
+            deadline = Clock.now()
+            while (dome.currentPos - position * dome.settings.pulsesPerDegree) % (360. * dome.settings.pulsesPerDegree) < 180. * dome.settings.pulsesPerDegree and dome.domeBusy:
+                deadline += dome.settings.checkInterval
+                Clock.waituntil(deadline)
+                if (Clock.now() - tmpTime > dome.settings.moveTimeout):
+                    if (oldPos == dome.currentPos):
                         # Raise error
                         logging.error("Timeout occured in moving dome to left.")
                         break
                     else:
-                        tmpTime = time.clock()
-                        oldPos = currentPos
+                        tmpTime = Clock.now()
+                        oldPos = dome.currentPos
             
-            if domeBusy:
+            if dome.domeBusy:
                 self.clearmove()
         else:
             # Move right
             self.setright()
             
             # Loop till dome has reached given position
-            while (currentPos - position * float(cfg['pulsesPerDegree'])) % (360. * float(cfg['pulsesPerDegree'])) > 180. * float(cfg['pulsesPerDegree']) and domeBusy:
-                time.sleep(float(cfg['checkInterval']))
-                if (time.clock() - tmpTime > float(cfg['moveTimeout'])):
-                    if (oldPos == currentPos):
+            deadline = Clock.now()
+            while (dome.currentPos - position * dome.settings.pulsesPerDegree) % (360. * dome.settings.pulsesPerDegree) > 180. * dome.settings.pulsesPerDegree and dome.domeBusy:
+                deadline += dome.settings.checkInterval
+                Clock.waituntil(deadline)
+                if (Clock.now() - tmpTime > dome.settings.moveTimeout):
+                    if (oldPos == dome.currentPos):
                         # Raise error
                         logging.error("Timeout occured in moving dome to right.")
                         break
                     else:
-                        tmpTime = time.clock()
-                        oldPos = currentPos
+                        tmpTime = Clock.now()
+                        oldPos = dome.currentPos
             
-            if domeBusy:
+            if dome.domeBusy:
                 self.clearmove()
         
     def calibrate(self):    
         # Calibration function, dome moves to zeroPoint and stops (in Position class)
         
-        global domeBusy
+        dome = self.dome
         
-        if domeBusy:
+        if dome.domeBusy:
             return 0
         else:
+            self.request()
             self.nextAction = 'calibrate'
+            self.wakeup.set()
             return 1
         
     def _calibrate_(self):
-        global cfg
-        global currentPos
-        global domeBusy
-        global calibrating
+        dome = self.dome
         
         logging.info("Calibrating zero-point of dome.")
         
-        if (currentPos / float(cfg['pulsesPerDegree']) - float(cfg['zeroAngle'])) % 360. < 180.:
+        if (dome.currentPos / dome.settings.pulsesPerDegree - dome.settings.zeroAngle) % 360. < 180.:
             # Left is the shortest way
             self.setleft()
         else:
             # Right is the shortest way
             self.setright()
         
-        calibrating = True
-        oldPos = currentPos
-        tmpTime1 = time.clock()
-        tmpTime2 = time.clock()
+        dome.calibrating = True
+        oldPos = dome.currentPos
+        tmpTime1 = Clock.now()
+        tmpTime2 = Clock.now()
         
         # check movement of dome during calibration
-        while calibrating and domeBusy:
-            if time.clock() - tmpTime1 > float(cfg['calibrateTimeOut']):
+        deadline = Clock.now()
+        while dome.calibrating and dome.domeBusy:
+            if Clock.now() - tmpTime1 > dome.settings.calibrateTimeOut:
                 # Raise error
-                logging.error("Timeout in calibration dome, previous position (now being set to 0): %s." % currentPos/float(cfg['pulsesPerDegree']))
+                logging.error("Timeout in calibration dome, previous position (now being set to 0): %s." % dome.currentPos/dome.settings.pulsesPerDegree)
                 break
 
-            if (time.clock() - tmpTime2 > float(cfg['moveTimeout'])):
-                if (oldPos == currentPos):
+            if (Clock.now() - tmpTime2 > dome.settings.moveTimeout):
+                if (oldPos == dome.currentPos):
                     # Raise error
                     logging.error("Timeout occured in moving dome.")
-                    domeBusy = False
+                    dome.domeBusy = False
                     break
                 else:
-                    tmpTime2 = time.clock()
-                    oldPos = currentPos
+                    tmpTime2 = Clock.now()
+                    oldPos = dome.currentPos
             
-            time.sleep(float(cfg['checkInterval']))
+            deadline += dome.settings.checkInterval
+            Clock.waituntil(deadline)
         
         # dome reached zeroPoint or error occured
-        if domeBusy:
+        if dome.domeBusy:
             self.clearmove()
-            currentPos = float(cfg['zeroAngle']) * float(cfg['pulsesPerDegree'])
+            dome.currentPos = dome.settings.zeroAngle * dome.settings.pulsesPerDegree
             logging.info("Finished calibration.")
         else:
             logging.info("Movement cleared before zero point was reached.")
         
-        calibrating = False
+        dome.calibrating = False
     
     def setleft(self, isTracking = False):
         # Function to move dome to left
         
-        global cfg
-        global domeBusy
+        dome = self.dome
         
         # check difference between internal call of movement (by tracking) of external
-        if domeBusy == False or isTracking:
-            domeBusy = True
+        if dome.domeBusy == False or isTracking:
+            dome.domeBusy = True
             logging.info("Moving dome to left.")
-            pportWrite(int(cfg['dataReg']), int(cfg['leftBit']))
-            time.sleep(float(cfg['pulseTime']))
-            pportWrite(int(cfg['dataReg']), 0)
+            Trace.awaitpulse(dome.name)
+            start, end = dome.relays.pulse(dome.settings.leftBit, dome.settings.pulseTime)
+            Trace.span('pulse left', start, end)
             return 1
         else:
             return 0
@@ -365,79 +565,100 @@ class Movement(threading.Thread):
     def clearmove(self, keepBusyState = False):
         # stop movement of dome
         
-        global cfg
-        global domeBusy
-	global currentPos
+        dome = self.dome
         
         logging.info("Stop movement of dome.")
-        pportWrite(int(cfg['dataReg']), int(cfg['clearBit']))
-        time.sleep(float(cfg['pulseTime']))
-        pportWrite(int(cfg['dataReg']), 0)
+        start, end = dome.relays.pulse(dome.settings.clearBit, dome.settings.pulseTime)
+        Trace.span('pulse clear', start, end)
         
         # set domeBusy to false if stop call was external (keep busy if tracking)
         if not keepBusyState:
-            domeBusy = False        
+            dome.domeBusy = False        
             
     def setright(self, isTracking = False):
         # move dome to right
         
-        global cfg
-        global domeBusy
+        dome = self.dome
         
         # check difference between internal call of movement (by tracking) of external
-        if domeBusy == False or isTracking:
-            domeBusy = True
+        if dome.domeBusy == False or isTracking:
+            dome.domeBusy = True
             logging.info("Moving dome to right.")
-            pportWrite(int(cfg['dataReg']), int(cfg['rightBit']))
-            time.sleep(float(cfg['pulseTime']))
-            pportWrite(int(cfg['dataReg']), 0)
+            Trace.awaitpulse(dome.name)
+            start, end = dome.relays.pulse(dome.settings.rightBit, dome.settings.pulseTime)
+            Trace.span('pulse right', start, end)
             return 1
         else:
             return 0
 
     def run(self):
         # function which handles next actions for movement
+        # goto, calibrate and track wake this thread, so an action is picked up
+        # at once, checkNextAction only bounds the wait
+        dome = self.dome
         while 1:
+            self.wakeup.clear()
             if self.nextAction != '':
+                Trace.setrequest(self.nextRequest)
+                Trace.span('pickup', self.requestTime, action=self.nextAction)
+                dome.savemode(self.nextAction, self.nextPosition)
+                
                 if self.nextAction == 'goto':
                     self._goto_(self.nextPosition)
                 if self.nextAction == 'calibrate':
                     self._calibrate_()
                 if self.nextAction == 'track':
                     self._track_()
-                    
+                
+                Trace.instant('stop', position=dome.currentPos/dome.settings.pulsesPerDegree)
+                Trace.end('move')
+                Trace.setrequest(None)
                 self.nextAction = ''
-            time.sleep(float(cfg['checkNextAction']))
+                dome.savemode('')
+            Clock.waituntil(Clock.now() + dome.settings.checkNextAction, self.wakeup)
             
 class ClientThread(threading.Thread):
     # Class which handles commands from every client connecting via server
     
     def handlecommand(self, string):
-        global domeBusy
+        # A command starting with the name of a dome is for that dome, other commands for the first dome
+        words = string.split()
+        dome = finddome(words[0]) if len(words) > 1 else None
+        if dome is None:
+            dome = Domes[0]
+        else:
+            words = words[1:]
         
         # The commands are defined below
-        commandList = {'POSITION': ((currentPos/float(cfg["pulsesPerDegree"])), "The current position is %s" % (int(currentPos/float(cfg["pulsesPerDegree"]),))),
-                       'PULSEPOSITION': (currentPos, "The current position in pulses is %s" % (currentPos,)),
-                       'DOMEBUSY': (int(domeBusy),domeBusy),
-                       'GOTO': 'self.goto(args[0])',
-                       'CALIBRATE': 'self.calibrate()',
-                       'LEFT': 'self.setleft()',
-                       'RIGHT': 'self.setright()',
-                       'STOP': '(1,"Movement cleared."); Move.clearmove()',
+        commandList = {'POSITION': ((dome.currentPos/dome.settings.pulsesPerDegree), "The current position is %s" % (int(dome.currentPos/dome.settings.pulsesPerDegree,))),
+                       'PULSEPOSITION': (dome.currentPos, "The current position in pulses is %s" % (dome.currentPos,)),
+                       'DOMEBUSY': (int(dome.domeBusy),dome.domeBusy),
+                       'GOTO': 'self.goto(dome, args[0])',
+                       'CALIBRATE': 'self.calibrate(dome)',
+                       'LEFT': 'self.setleft(dome)',
+                       'RIGHT': 'self.setright(dome)',
+                       'STOP': '(1,"Movement cleared."); dome.move.clearmove()',
                        'UPDATECONFIG': 'self.updateconfig()',
-                       'TRACK': 'self.track()'}
+                       'TRACK': 'self.track(dome)',
+                       'HISTORY': 'self.history(dome, args)',
+                       'PORTSTATS': 'self.portstats(dome)',
+                       'TELESCOPE': 'self.telescope(dome)',
+                       'TARGET': 'self.target(dome, args)',
+                       'STATUS': 'self.status(dome)',
+                       'DOMES': 'self.domes()',
+                       'PING': '(1, "Running.")'}
         
-        command = string.split()[0]
-        args = string.split()[1:]
+        command = words[0]
+        args = words[1:]
         
         exec("res = %s" % (commandList.get(command.upper(), "(0,'Command doesn`t exist')"),))
         return res
     
-    def goto(self, strdegree):
+    def goto(self, dome, strdegree):
         # check difference between goto a relative angle (+ or -) or a absolute angle
         if strdegree[0] == '+' or strdegree[0] == '-':
             try:
-                degree = currentPos/float(cfg["pulsesPerDegree"]) + float(strdegree)
+                degree = dome.currentPos/dome.settings.pulsesPerDegree + float(strdegree)
             except TypeError:
                 return (0, "Invalid degree number: %s" % strdegree)
         else:
@@ -446,25 +667,25 @@ class ClientThread(threading.Thread):
             except TypeError:
                 return (0, "Invalid degree number: %s" % strdegree)
         
-        if Move.goto(degree):
+        if dome.move.goto(degree):
             return (1,"Moving dome to %s." % int(degree))
         else: 
             return (0,"Dome is busy")
         
-    def calibrate(self):
-        if Move.calibrate():
+    def calibrate(self, dome):
+        if dome.move.calibrate():
             return (1,"Calibrating dome.")
         else:
             return (0,"Dome is busy")
 
-    def setleft(self):
-        if not Move.setleft():
+    def setleft(self, dome):
+        if not dome.move.setleft():
             return (0,"Dome is busy")
         else:
             return (1,"Moving dome to left.")
 
-    def setright(self):
-        if not Move.setright():
+    def setright(self, dome):
+        if not dome.move.setright():
             return (0,"Dome is busy")
         else:
             return (1,"Moving dome to right.")
@@ -475,11 +696,76 @@ class ClientThread(threading.Thread):
         else:
             return (0, 'Error in reading config file')
     
-    def track(self):
-        if not Move.track():
+    def track(self, dome):
+        if not dome.move.track():
             return (0, 'Dome is busy.')
         else:
             return (1, 'Tracking telescope.') 
+    
+    def portstats(self, dome):
+        # Port I/O counters and rates since start
+        stats = dome.port.stats()
+        return (1, "Reads: %d (%.0f/s), writes: %d (%.2f/s), relay changes: %d in %d writes" %
+                (stats['reads'], stats['readRate'], stats['writes'], stats['writeRate'], dome.outputs.changes, dome.outputs.writes))
+    
+    def telescope(self, dome):
+        # Latest reading of the telescope poller as 'azimuth altitude'
+        reading = dome.telescope.latest()
+        if reading is None:
+            return (0, "Telescope position unknown")
+        return ("%.3f %.3f" % reading[:2], "Telescope at azimuth %.2f, altitude %.2f, read %.1f s ago" %
+                (reading[0], reading[1], Clock.now() - reading[2]))
+    
+    def target(self, dome, args):
+        # Move the slit to a target given as RA (hours) and Dec (degrees), as now in the sky
+        # For positioning the dome while the telescope slews, see planner.py for a whole night
+        import planner
+        try:
+            ra, dec = planner.sexagesimal(args[0]), planner.sexagesimal(args[1])
+        except (ValueError, IndexError):
+            return (0, "Usage: TARGET <ra> <dec>")
+        az, alt = planner.slitaz(ra, dec, Clock.time(), dome.geometry, dome.settings.siteLatitude, dome.settings.siteLongitude)
+        if alt < 0:
+            return (0, "Target is below the horizon")
+        if dome.move.goto(az):
+            return (1, "Moving dome to %.2f for the target." % az)
+        else:
+            return (0, "Dome is busy")
+    
+    def status(self, dome):
+        # Dome and telescope in one reply as 'position busy azimuth altitude age' (nan when unknown)
+        position = dome.currentPos / dome.settings.pulsesPerDegree
+        reading = dome.telescope.latest() or (float('nan'), float('nan'), float('-inf'))
+        age = Clock.now() - reading[2]
+        return ("%.3f %d %.3f %.3f %.1f" % (position, dome.domeBusy, reading[0], reading[1], age),
+                "Dome at %.2f, busy: %s, telescope at azimuth %.2f, altitude %.2f" % (position, dome.domeBusy, reading[0], reading[1]))
+    
+    def domes(self):
+        # Names of the domes, the first one takes the commands without a dome name
+        names = [dome.name for dome in Domes]
+        return (' '.join(names), "Domes: %s" % (', '.join(names),))
+    
+    def history(self, dome, args):
+        # Telemetry between two times as lines of 'time position telescope-azimuth' (in degrees)
+        # Times are unix times, 'now' or a negative number of seconds relative to now
+        # The series is downsampled on the server to at most maxpoints samples, at least
+        # 4: the minimum and maximum of the position and telescope azimuth (see telemetry.py)
+        now = Clock.time()
+        try:
+            start, end = [now if arg.lower() == 'now' else (now + float(arg) if arg[0] == '-' else float(arg)) for arg in args[:2]]
+            maxpoints = int(args[2]) if len(args) > 2 else dome.settings.historyMaxPoints
+        except (ValueError, IndexError):
+            return (0, "Usage: HISTORY <from> <to> [maxpoints]")
+        if maxpoints < 4:
+            return (0, "Usage: HISTORY <from> <to> [maxpoints], maxpoints at least 4")
+        
+        try:
+            samples = telemetry.history(dome.telemetryDir, start, end, maxpoints)
+        except ImportError:
+            return (0, "History not available, numpy is not installed")
+        ppd = dome.settings.pulsesPerDegree
+        lines = ["%.3f %.3f %.3f" % sample for sample in zip(samples['time'], samples['position'] / ppd, samples['teleaz'])]
+        return (1, '\n'.join(lines))
             
     def run(self):
         global cfg
@@ -489,78 +775,464 @@ class ClientThread(threading.Thread):
             client = clientPool.get()
             
             if client != None:
-                logging.info('Connection received from %s on port %s' % client[1])
-                command = client[0].recv(int(cfg['bufferSize']))
+                Trace.setrequest(client[2])
+                Trace.span('queued', client[3])
+                start = Trace.now()
+                command = client[0].recv(Settings.bufferSize)
+                Trace.span('recv', start)
+                # Health checks (PING, see supervisor.py) are not logged
+                quiet = command.strip().upper() == 'PING'
+                if not quiet:
+                    logging.info('Connection received from %s on port %s' % client[1])
                 if command == '':
                     logging.info('Connection with %s lost' % (client[1][0],))
                 else:
-                    logging.info('Command given from %s: %s' % (client[1][0], command))
+                    if not quiet:
+                        logging.info('Command given from %s: %s' % (client[1][0], command))
+                    start = Trace.now()
                     res = self.handlecommand(command)
-                    client[0].send("%s\n%s\n" % (res[0],res[1]))
-                    logging.info('Returned to %s: %s, code: %o' % (client[1][0], res[1], res[0]))
+                    Trace.span('dispatch', start, command=command)
+                    client[0].sendall("%s\n%s\n" % (res[0],res[1]))
+                    # Replies of several lines (HISTORY) are only logged by their number of lines
+                    reply = str(res[1])
+                    if '\n' in reply:
+                        reply = '%d lines' % (reply.count('\n') + 1,)
+                    if not quiet:
+                        logging.info('Returned to %s: %s, code: %s' % (client[1][0], reply, res[0]))
                     client[0].close()
-                    logging.info('Connection to %s closed' % (client[1][0],))
+                    if not quiet:
+                        logging.info('Connection to %s closed' % (client[1][0],))
+                Trace.end('request')
+                Trace.setrequest(None)
                     
 class ServerThread(threading.Thread):
     # Class for setting up a server
     # Server handles incoming connection requests
     
+    server = None               # Listening socket
+    
+    def listen(self):
+        # Listening socket on serverPort
+        server = socket.socket ( socket.AF_INET, socket.SOCK_STREAM )
+        if os.name != 'nt':
+            # A restarted koepelX binds at once, despite connections of the old one in TIME_WAIT
+            # (on Windows the option would let a second process take the port in use)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind ( ( socket.gethostname(), Settings.serverPort ) )
+        server.listen ( Settings.maxConnections )
+        return server
+    
+    def configure(self, changed=()):
+        # Listen on the new port, the old socket is closed once the new one is listening
+        if self.server is None:
+            return
+        try:
+            server = self.listen()
+        except socket.error as e:
+            logging.error("Cannot listen on port %s, staying on the current port: %s" % (Settings.serverPort, e))
+            return
+        old, self.server = self.server, server
+        try:
+            old.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        old.close()
+        logging.info("Server listening on port %s" % (Settings.serverPort,))
+    
     def run(self):
         global cfg
         global clientPool
         
         # Create client pool and threads
-        clientPool = Queue.Queue(int(cfg['maxQueueSize']))
-        for x in xrange(int(cfg['clientThreads'])):
-            ClientThread().start()
+        clientPool = Queue.Queue(Settings.maxQueueSize)
+        for x in xrange(Settings.clientThreads):
+            ClientThread(name='Client-%d' % x).start()
         
         # Set up the server:
-        server = socket.socket ( socket.AF_INET, socket.SOCK_STREAM )
-        server.bind ( ( socket.gethostname(), int(cfg['serverPort']) ) )
-        server.listen ( int(cfg['maxConnections']) )
+        self.server = self.listen()
         
         while True:
-            clientPool.put ( server.accept() )
+            server = self.server
+            try:
+                connection, address = server.accept()
+            except socket.error:
+                if server is not self.server:
+                    # Replaced by a socket on another port
+                    continue
+                raise
             
-                       
-def updateconfig():
-    # Function to update the config file when called on by a client
+            # Each connection is a request which is traced till its command is finished
+            request = Trace.newrequest()
+            start = Trace.now()
+            Trace.instant('accept', request, address=address[0])
+            Trace.begin('request', request, start)
+            clientPool.put ( (connection, address, request, start) )
+            Trace.span('enqueue', start, request=request)
+            
+
+class TelemetrySampler(threading.Thread):
+    # Class which samples the state of the domes for the telemetry recorder
+    # Every dome is sampled every telemetryInterval and on every change of its relay outputs,
+    # the samples of all domes go through a single recorder
     
-    global cfg
-    global val
+    def __init__(self):
+        threading.Thread.__init__(self, name='Telemetry')
+        self.recorder = telemetry.Recorder(Settings.telemetryDir)
     
-    try:
-        cfg.reload()
-    except ReloadError:
-        logging.error("Error reading configfile")
-        return 0
+    def sample(self, dome):
+        # Queue a sample of the current state of a dome, never blocks the calling thread
+        reading = dome.telescope.latest() or (float('nan'), float('nan'))
+        self.recorder.record(Clock.time(), dome.currentPos, dome.domeBusy, dome.move.nextAction, reading[0], reading[1],
+                             dome.relayState, dome.telemetryDir)
+    
+    def run(self):
+        self.recorder.start()
+        deadline = Clock.now()
+        while 1:
+            for dome in Domes:
+                self.sample(dome)
+            deadline += Settings.telemetryInterval
+            Clock.waituntil(deadline)
+
+
+class DomeController(object):
+    # A dome with its own config, printer port, relays, position, movement and telescope
+    # The clock, server, tracing and telemetry are shared by all domes of the process.
+    # name is the name by which commands are routed to the dome, section its section
+    # under [domes] of the config file, None for a config file of a single dome.
+    # port is the printer port (see ports.py), source the telescope source, by
+    # default the one of the config (see telescope.py).
+    # All objects of the dome are created before any of its threads is started,
+    # the relay outputs for instance sample the telemetry which needs move.
+    
+    def __init__(self, name, cfg, port, source=None, section=None):
+        self.name = name
+        self.cfg = cfg
+        self.currentPos = 0.0           # Starting position
+        self.domeBusy = False           # Boolean for movement of dome
+        self.calibrating = False        # Indicator if the current state is 'calibrating'
+        self.relayState = 0             # Value last written to the relay outputs (data register)
+        
+        # Typed values of the config, read as attributes (see settings.py)
+        self.settings = settings.fromconfig(cfg)
+        
+        # Changes of the config file are applied to the subsystems using the changed keys
+        specfile = os.path.join(os.path.dirname(cfg.filename or ''), 'configspec.ini')
+        self.watcher = settings.Watcher(cfg.filename, specfile, self.applyconfig, self.settings,
+                                        self.settings.configWatchInterval, Clock, section)
+        
+        # The telemetry of the domes of a config with [domes] goes to a directory per dome
+        self.telemetryDir = Settings.telemetryDir if section is None else os.path.join(Settings.telemetryDir, name)
+        
+        # All access to the printer port goes through port, which counts the reads and writes
+        self.port = port
+        
+        self.outputs = relay.OutputRegister(self.writerelay)
+        self.relays = relay.RelayScheduler(self.outputs, Clock)
+        self.relays.name = 'Relays-%s' % (name,)
+        self.move = Movement(self, name='Movement-%s' % (name,))
+        
+        # Geometry of the telescope in the dome
+        self.geometry = geometry.fromconfig(cfg)
+        
+        # The telescope is read by a single poller, shared by tracking, commands and telemetry
+        if source is None:
+            source = telescope.opensource(cfg, Clock)
+        history = int(self.settings.trackHistory / self.settings.telescopeInterval) + 2
+        self.telescope = telescope.Poller(source, self.settings.telescopeInterval, self.settings.telescopeRetry, Clock, history,
+                                          name='Telescope-%s' % (name,))
+        
+        self.position = Position(self, name='Position-%s' % (name,))
+        
+        # The Position thread subscribes itself, tracking and the telemetry read the other values on every pass
+        self.watcher.subscribe(TRACKINGKEYS, self.move.configure)
+        self.watcher.subscribe(GEOMETRYKEYS, self.configuregeometry)
+        self.watcher.subscribe(TELESCOPEKEYS, self.configuretelescope)
+        self.watcher.subscribe(DOMERESTARTKEYS, restartneeded)
+        self.watcher.subscribe(('configWatchInterval',), self.configurewatcher)
+    
+    def start(self):
+        # Spawn the threads of the dome
+        self.relays.start()
+        self.position.start()
+        self.move.start()
+        self.telescope.start()
+        self.watcher.start()
+    
+    def savemode(self, action, position=0.):
+        # Keep the running action in currentModeFile: track, goto <degree> or calibrate, empty when
+        # the dome is idle. A koepelX restarted with --resume takes the action up again (see resume)
+        if not self.settings.currentModeFile:
+            return
+        if action == 'goto':
+            action = 'goto %s' % (position,)
+        try:
+            f = open(self.settings.currentModeFile, 'w')
+            try:
+                f.write(action)
+            finally:
+                f.close()
+        except IOError as e:
+            logging.error('Cannot write mode file: %s' % (e,))
+    
+    def resume(self):
+        # Take up the action kept in currentModeFile, called after the start with --resume
+        # The motor may still turn after a crash, so the dome is stopped first
+        if not self.settings.currentModeFile:
+            return
+        try:
+            f = open(self.settings.currentModeFile)
+            try:
+                words = f.read().split()
+            finally:
+                f.close()
+        except IOError:
+            return
+        if not words:
+            return
+        logging.info('Resuming %s of dome %s' % (' '.join(words), self.name))
+        self.move.clearmove()
+        if words[0] == 'track':
+            self.move.track()
+        elif words[0] == 'calibrate':
+            self.move.calibrate()
+        elif words[0] == 'goto' and len(words) == 2:
+            try:
+                self.move.goto(float(words[1]))
+            except ValueError:
+                logging.error('Invalid mode file: %s' % (' '.join(words),))
+        else:
+            logging.error('Invalid mode file: %s' % (' '.join(words),))
     
-    if not (cfg.validate(val)):
-        logging.error("Error in configfile")
+    def writerelay(self, value):
+        # Write the relay outputs (data register) and remember the value for telemetry
+        # Only called by the output register, use relays.pulse() to push a button
+        self.port.write(self.settings.dataReg, value)
+        self.relayState = value
+        Telemetry.sample(self)
+    
+    def telescopeposition(self, ahead=0.):
+        # Azimuth and altitude of the telescope from the poller, None without a recent reading
+        # With trackMode sidereal or extrapolate the position ahead seconds from now is
+        # predicted, reactive tracking uses the latest reading.
+        reading = self.telescope.latest()
+        if reading is None or Clock.now() - reading[2] > self.settings.telescopeTimeout:
+            return None
+        t = Clock.now() + ahead
+        if self.settings.trackMode == 'sidereal':
+            return telescope.sidereal(reading[0], reading[1], self.settings.siteLatitude, t - reading[2])
+        if self.settings.trackMode == 'extrapolate':
+            return telescope.extrapolate(self.telescope.recent(self.settings.trackHistory), t)
+        return reading[:2]
+    
+    def slitaz(self, ahead=0.):
+        # Azimuth at which the slit is to be for the telescope (see geometry.py), None without a recent reading
+        position = self.telescopeposition(ahead)
+        if position is None:
+            return None
+        return self.geometry.slitaz(*position)
+    
+    def slewtarget(self):
+        # Slit azimuth where a slew of the telescope ends, None when the telescope is not slewing
+        # Sources which know the destination of a slew give it (see telescope.py), otherwise a
+        # slew is detected from the rate of the telescope over the sky exceeding slewRate and
+        # the dome heads for trackStartFraction times the opening ahead of the telescope, so a
+        # dome faster than the telescope does not stop and start again for every opening.
+        reading = self.telescope.latest()
+        if reading is None or Clock.now() - reading[2] > self.settings.telescopeTimeout:
+            return None
+        destination = self.telescope.slew()
+        if destination is not None:
+            return self.geometry.slitaz(*destination)
+        rate = self.telescope.rate()
+        if self.settings.slewRate > 0 and rate is not None and rate > self.settings.slewRate:
+            previous = self.geometry.slitaz(*self.telescope.last(2)[0][:2])
+            az = self.geometry.slitaz(*reading[:2])
+            ahead = self.move.startAngle
+            if (az - previous) % 360. > 180.:
+                ahead = -ahead
+            return (az + ahead) % 360.
+        return None
+    
+    def applyconfig(self, new, values):
+        # Make the reloaded config of the dome current, called by its watcher before notifying
+        # the subsystems of the dome. Its threads read self.settings on every pass.
+        self.cfg = new
+        self.settings = values
+    
+    def configuregeometry(self, changed):
+        self.geometry = geometry.fromconfig(self.cfg)
+    
+    def configuretelescope(self, changed):
+        self.telescope.interval = self.settings.telescopeInterval
+        self.telescope.retry = self.settings.telescopeRetry
+        if changed & set(('telescopeSource', 'telescopeFile', 'telescopeHost', 'telescopePort')):
+            try:
+                self.telescope.replace(telescope.opensource(self.cfg, Clock))
+            except (IOError, ValueError) as e:
+                logging.error("Cannot open telescope source of dome %s, keeping the current one: %s" % (self.name, e))
+    
+    def configurewatcher(self, changed):
+        self.watcher.setinterval(self.settings.configWatchInterval)
+
+
+def finddome(name):
+    # Controller of the dome with the given name (not case sensitive), None if there is none
+    name = name.lower()
+    for dome in Domes:
+        if dome.name.lower() == name:
+            return dome
+    return None
+
+def setup(config, timer=clock.system, trace=True):
+    # Create the objects shared by the domes, the domes are added with adddome
+    # timer is the clock used for all timing (see clock.py), a virtual clock runs
+    # koepelX in simulated time. Without trace the traceFile is not opened.
+    global cfg, Clock, Trace, Telemetry, Settings, Watcher, Server
+    
+    cfg = config
+    
+    # Typed values of the top level of the config, used by the shared objects (see settings.py)
+    Settings = settings.fromconfig(cfg)
+    
+    Clock = timer
+    
+    # The shared objects follow the top level of the config file, every dome its own config
+    specfile = os.path.join(os.path.dirname(cfg.filename or ''), 'configspec.ini')
+    Watcher = settings.Watcher(cfg.filename, specfile, applyconfig, Settings, Settings.configWatchInterval, Clock)
+    
+    # Tracing of client requests
+    Trace = tracing.Tracer(Settings.traceFile if trace else '', Clock)
+    
+    Telemetry = TelemetrySampler()
+    Server = ServerThread(name='Server')
+    del Domes[:]
+    
+    Watcher.subscribe(SERVERKEYS, Server.configure)
+    Watcher.subscribe(RESTARTKEYS, restartneeded)
+    Watcher.subscribe(('configWatchInterval',), configurewatcher)
+
+def adddome(name, config, port, source=None, section=None):
+    # Add a dome to the process (see DomeController), after setup
+    dome = DomeController(name, config, port, source, section)
+    Domes.append(dome)
+    return dome
+
+def applyconfig(new, values):
+    # Make the reloaded config of the process current (the server, client threads and
+    # telemetry read Settings), called by the watcher of the file before notifying them
+    global cfg, Settings
+    cfg = new
+    Settings = values
+
+def configurewatcher(changed):
+    Watcher.setinterval(Settings.configWatchInterval)
+
+def restartneeded(changed):
+    logging.warning("Changes of %s take effect after a restart" % (', '.join(sorted(changed)),))
+
+def updateconfig():
+    # Function to update the config file when called on by a client
+    # The file is read as when the watchers see it change, only changed keys are applied
+    
+    if not Watcher.reload():
         return 0
+    for dome in Domes:
+        if not dome.watcher.reload():
+            return 0
     
     logging.info("Config file read.")
     return 1
 
 
-# Read configfile
-cfg = ConfigObj(configfile, configspec=configspecfile)
-cfg.stringify = True
-val = Validator()
-if not (cfg.validate(val)):
-    print("Error in configfile")
-    import sys
-    sys.exit()
-
-# Set logging config
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s %(levelname)-8s %(message)s',
-                    datefmt='%a, %d %b %Y %H:%M:%S',
-                    filename=cfg['logfile'],
-                    filemode='a')          
-
-# Spawn threads
-Position().start()
-ServerThread().start()
-Move = Movement()
-Move.start()
+def startupreport(begin, steps):
+    # Durations of the imports and of the steps of the startup, given as (name, time at its end)
+    parts = ['imports %.1f ms' % (loadTime * 1e3,)]
+    total = loadTime
+    for name, end in steps:
+        parts.append('%s %.1f ms' % (name, (end - begin) * 1e3))
+        total += end - begin
+        begin = end
+    return "Started in %.1f ms: %s" % (total * 1e3, ', '.join(parts))
+
+def main(argv=None):
+    # Read the config, create the domes and start the threads
+    #   python koepelX.py [--config config.ini] [--check] [--resume]
+    #   python -m koepelX [--config config.ini] [--check] [--resume]
+    # Returns 1 when the config is not valid
+    import optparse
+    from configobj import ConfigObj
+    from validate import Validator
+    
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--config', default=configfile, help='config file [%default]')
+    parser.add_option('--check', action='store_true',
+                      help='read the config and create the domes, then print the startup times and exit without starting threads')
+    parser.add_option('--resume', action='store_true',
+                      help='take up the action kept in currentModeFile of every dome, used by supervisor.py')
+    options, args = parser.parse_args(argv)
+    
+    begin = time.time()
+    steps = []                  # (name, time at its end) of the steps of the startup
+    
+    # Read configfile
+    specfile = os.path.join(os.path.dirname(options.config), configspecfile)
+    cfg = ConfigObj(options.config, configspec=specfile)
+    cfg.stringify = True
+    val = Validator()
+    if cfg.validate(val) is not True:
+        print("Error in configfile")
+        return 1
+    
+    # Set logging config, a check writes no files and logs to stderr
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%a, %d %b %Y %H:%M:%S',
+                        filename=None if options.check else cfg['logfile'],
+                        filemode='a')          
+    steps.append(('config', time.time()))
+    
+    # The trace file of a running koepelX is not truncated by a check
+    setup(cfg, trace=not options.check)
+    steps.append(('setup', time.time()))
+    
+    # A config without [domes] is a single dome, otherwise every section under [domes] is one
+    # Each dome opens the printer port with the backend selected in its config (see ports.py)
+    names = settings.domenames(cfg)
+    if not names:
+        adddome('dome', cfg, ports.openport(cfg))
+    for name in names:
+        domecfg = settings.domeconfig(cfg, name, specfile)
+        if domecfg is None:
+            print("Error in config of dome %s" % (name,))
+            return 1
+        adddome(name, domecfg, ports.openport(domecfg), section=name)
+    if len(set(dome.settings.currentPosFile for dome in Domes)) < len(Domes):
+        print("Every dome needs a currentPosFile of its own")
+        return 1
+    modefiles = [dome.settings.currentModeFile for dome in Domes if dome.settings.currentModeFile]
+    if len(set(modefiles)) < len(modefiles):
+        print("Every dome needs a currentModeFile of its own")
+        return 1
+    steps.append(('domes', time.time()))
+    
+    if options.check:
+        print(startupreport(begin, steps))
+        return 0
+    
+    # Spawn threads
+    for dome in Domes:
+        dome.start()
+    Server.start()
+    Telemetry.start()
+    Watcher.start()
+    steps.append(('threads', time.time()))
+    logging.info(startupreport(begin, steps))
+    if options.resume:
+        for dome in Domes:
+            dome.resume()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# Dome azimuth planning for targets given in RA and Dec
+#
+# For a list of targets with their time windows the azimuth of the slit is
+# computed for the whole night, vectorized over all targets and times, and a
+# slew plan tells when the dome has to leave for the next target to be there
+# when its window starts. Observing scripts can use it, or the TARGET command
+# of koepelX, to move the dome during a slew of the telescope instead of
+# waiting for tracking to notice the telescope has moved away.
+#
+# A target list has one target per line:
+#
+#   name  ra  dec  start  end
+#
+# ra in hours (12.5 or 12:30:00), dec in degrees (-5.25 or -05:15:00), start
+# and end in UTC (2024-01-01T20:00:00) or as unix times. Empty lines and lines
+# starting with # are skipped.
+#
+#   python planner.py [--config config.ini] [--step 60] targets.txt
+
+import os, math, calendar, time, optparse
+import telescope, geometry
+
+
+class Target(object):
+    # Target with its RA (hours), Dec (degrees) and time window (unix times)
+
+    def __init__(self, name, ra, dec, start, end):
+        self.name = name
+        self.ra = ra
+        self.dec = dec
+        self.start = start
+        self.end = end
+
+
+def sexagesimal(text):
+    # Number from 12.5, 12:30 or -05:15:00
+    if ':' not in text:
+        return float(text)
+    parts = [float(part) for part in text.split(':')]
+    value = abs(parts[0]) + sum(part / 60. ** i for i, part in enumerate(parts[1:], 1))
+    return -value if text.strip().startswith('-') else value
+
+
+def _time(text):
+    # Unix time from a UTC date and time or a number
+    try:
+        return float(text)
+    except ValueError:
+        return calendar.timegm(time.strptime(text.rstrip('Z'), '%Y-%m-%dT%H:%M:%S'))
+
+
+def loadtargets(path):
+    # Targets of a target list, sorted by the start of their window
+    targets = []
+    for line in open(path):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        name, ra, dec, start, end = line.split()[:5]
+        targets.append(Target(name, sexagesimal(ra), sexagesimal(dec), _time(start), _time(end)))
+    targets.sort(key=lambda target: target.start)
+    return targets
+
+
+def gmst(t):
+    # Greenwich mean sidereal time in degrees at unix time t (a number or a numpy array)
+    days = t / 86400. - 10957.5        # Days since J2000.0
+    return (280.46061837 + 360.98564736629 * days) % 360.
+
+
+def hourangle(ra, t, longitude):
+    # Hour angle in degrees of RA (hours) at unix time t, longitude in degrees east
+    return (gmst(t) + longitude - 15. * ra) % 360.
+
+
+def azalts(ha, dec, latitude):
+    # telescope.azalt on numpy arrays
+    import numpy as np
+    ha, dec, lat = np.radians(ha), np.radians(dec), math.radians(latitude)
+    alt = np.arcsin(np.sin(dec) * math.sin(lat) + np.cos(dec) * math.cos(lat) * np.cos(ha))
+    az = np.arctan2(-np.sin(ha) * np.cos(dec), math.cos(lat) * np.sin(dec) - math.sin(lat) * np.cos(dec) * np.cos(ha))
+    return np.degrees(az) % 360., np.degrees(alt)
+
+
+def slitaz(ra, dec, t, geo, latitude, longitude):
+    # Slit azimuth and the altitude for a single RA and Dec at unix time t, without numpy
+    az, alt = telescope.azalt(hourangle(ra, t, longitude), dec, latitude)
+    return geo.slitaz(az, alt), alt
+
+
+class Plan(object):
+    # Slit azimuths of targets over their windows
+    # For every target the arrays times, az, alt and slit hold the samples of
+    # its window, every step seconds and at its end.
+
+    def __init__(self, targets, geo, latitude, longitude, step=60.):
+        import numpy as np
+        self.targets = targets
+        # The samples of all targets are computed at once
+        times = [np.append(np.arange(target.start, target.end, step), target.end) for target in targets]
+        counts = [len(t) for t in times]
+        t = np.concatenate(times)
+        ra = np.repeat([target.ra for target in targets], counts)
+        dec = np.repeat([target.dec for target in targets], counts)
+        az, alt = azalts(hourangle(ra, t, longitude), dec, latitude)
+        slit = geo.slitazs(az, alt)
+        edges = np.cumsum(counts)[:-1]
+        self.times = np.split(t, edges)
+        self.az = np.split(az, edges)
+        self.alt = np.split(alt, edges)
+        self.slit = np.split(slit, edges)
+
+    def slews(self, position, speed):
+        # Moves of the dome between the targets, starting at position (degrees)
+        # Returns per target (target, departure time, arrival time, from, to,
+        # angle), the angle is the shortest way, negative to the left. The dome
+        # departs when the previous window ends or as late as possible to
+        # arrive at the start of the window.
+        moves = []
+        free = None
+        for target, times, slit in zip(self.targets, self.times, self.slit):
+            angle = (slit[0] - position + 180.) % 360. - 180.
+            duration = abs(angle) / speed
+            departure = target.start - duration
+            if free is not None:
+                departure = max(departure, free)
+            moves.append((target, departure, departure + duration, position % 360., slit[0], angle))
+            position, free = slit[-1], target.end
+        return moves
+
+
+def _utc(t):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t))
+
+
+def main():
+    from configobj import ConfigObj
+    from validate import Validator
+
+    parser = optparse.OptionParser(usage='%prog [options] targets')
+    parser.add_option('--config', default='config.ini', help='config file of koepelX [%default]')
+    parser.add_option('--step', type='float', default=60., help='seconds between the samples of the plan [%default]')
+    parser.add_option('--position', type='float', default=None, help='dome position at the start [zeroAngle]')
+    parser.add_option('--samples', action='store_true', help='list the slit azimuths of every target')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('no target list given')
+
+    cfg = ConfigObj(options.config, configspec=os.path.join(os.path.dirname(options.config), 'configspec.ini'))
+    cfg.validate(Validator())
+    plan = Plan(loadtargets(args[0]), geometry.fromconfig(cfg), float(cfg['siteLatitude']),
+                float(cfg['siteLongitude']), options.step)
+    position = float(cfg['zeroAngle']) if options.position is None else options.position
+
+    print('%-16s %-19s %-19s %7s %7s %7s' % ('target', 'depart (UTC)', 'arrive (UTC)', 'from', 'to', 'angle'))
+    for target, departure, arrival, start, end, angle in plan.slews(position, float(cfg['domeSpeed'])):
+        print('%-16s %-19s %-19s %7.2f %7.2f %+7.2f' % (target.name, _utc(departure), _utc(arrival), start, end, angle))
+    for target, alt in zip(plan.targets, plan.alt):
+        if alt.min() < 0:
+            print('Warning: %s is below the horizon during its window' % target.name)
+
+    if options.samples:
+        for target, times, az, alt, slit in zip(plan.targets, plan.times, plan.az, plan.alt, plan.slit):
+            print('\n%s' % target.name)
+            for sample in zip(times, az, alt, slit):
+                print('%s %8.3f %8.3f %8.3f' % ((_utc(sample[0]),) + tuple(sample[1:])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+# Printer port access for the dome controller
+#
+# All reads and writes of the port go through a Port object, which counts
+# them so the I/O rate of the controller can be reported. The backend is chosen
+# with portBackend in the config (see openport()):
+#   inpout   inpoutx64.dll on Windows (the observatory PC)
+#   ppdev    Linux parallel port device (portDevice, e.g. /dev/parport0)
+#   devport  Linux /dev/port, direct access to the I/O addresses (root only)
+#   sim      In-memory port whose status register is driven by a dome model
+# Registers are addressed by their I/O address (dataReg, statusReg, ctrlReg)
+# for all backends.
+
+import os, math, struct, threading
+import clock
+
+
+class Port(object):
+    # Counting access to the registers of a port
+    # Subclasses implement rawread(address) and rawwrite(address, value)
+    # Rates are measured with timer, a clock object (see clock.py)
+
+    def __init__(self, timer=clock.system):
+        self.clock = timer
+        self.reads = 0
+        self.writes = 0
+        self.started = timer.now()
+
+    def read(self, address):
+        self.reads += 1
+        return self.rawread(address)
+
+    def write(self, address, value):
+        self.writes += 1
+        self.rawwrite(address, value)
+
+    def stats(self):
+        # Number of reads and writes, and their rates per second since start
+        elapsed = max(self.clock.now() - self.started, 1e-9)
+        return {'reads': self.reads, 'writes': self.writes,
+                'readRate': self.reads / elapsed, 'writeRate': self.writes / elapsed}
+
+
+class FunctionPort(Port):
+    # Port accessed with a pair of read(address) and write(address, value) functions
+
+    def __init__(self, read, write):
+        Port.__init__(self)
+        self.rawread = read
+        self.rawwrite = write
+
+
+class InpOutPort(Port):
+    # Port accessed with inpoutx64.dll (Windows)
+
+    def __init__(self):
+        from ctypes import windll
+        Port.__init__(self)
+        self.rawread = windll.inpoutx64.DlPortReadPortUchar
+        self.rawwrite = windll.inpoutx64.DlPortWritePortUchar
+
+
+def _ioc(direction, number, size):
+    # Linux ioctl request number of the ppdev driver (type 'p')
+    return (direction << 30) | (size << 16) | (ord('p') << 8) | number
+
+PPRSTATUS = _ioc(2, 0x81, 1)
+PPRCONTROL = _ioc(2, 0x83, 1)
+PPWCONTROL = _ioc(1, 0x84, 1)
+PPRDATA = _ioc(2, 0x85, 1)
+PPWDATA = _ioc(1, 0x86, 1)
+PPCLAIM = _ioc(0, 0x8b, 0)
+
+
+class PpdevPort(Port):
+    # Port accessed with the Linux ppdev driver
+    # The driver addresses the registers relative to the port, so addresses
+    # are translated with the data register as base address.
+
+    def __init__(self, device, base):
+        import fcntl
+        Port.__init__(self)
+        self.fcntl = fcntl
+        self.fd = os.open(device, os.O_RDWR)
+        fcntl.ioctl(self.fd, PPCLAIM)
+        self.readrequests = {base: PPRDATA, base + 1: PPRSTATUS, base + 2: PPRCONTROL}
+        self.writerequests = {base: PPWDATA, base + 2: PPWCONTROL}
+
+    def rawread(self, address):
+        return ord(self.fcntl.ioctl(self.fd, self.readrequests[address], b'\0'))
+
+    def rawwrite(self, address, value):
+        self.fcntl.ioctl(self.fd, self.writerequests[address], struct.pack('B', value))
+
+
+class DevPort(Port):
+    # Port accessed through /dev/port (Linux, needs root)
+
+    def __init__(self, device='/dev/port'):
+        Port.__init__(self)
+        self.fd = os.open(device, os.O_RDWR)
+        self.lock = threading.Lock()        # seek and read/write are not atomic
+
+    def rawread(self, address):
+        with self.lock:
+            os.lseek(self.fd, address, os.SEEK_SET)
+            return ord(os.read(self.fd, 1))
+
+    def rawwrite(self, address, value):
+        with self.lock:
+            os.lseek(self.fd, address, os.SEEK_SET)
+            os.write(self.fd, struct.pack('B', value))
+
+
+class SimulatedPort(Port):
+    # In-memory port for running the controller without hardware
+    # Writes to the data register are passed to the dome model as commands,
+    # reads of the status register return the encoder and zero bits of the
+    # model. Other registers just keep the value last written. The model gets
+    # the time of timer (see clock.py) with every call.
+
+    def __init__(self, dome, dataReg, statusReg, timer=clock.system):
+        Port.__init__(self, timer)
+        self.dome = dome
+        self.dataReg = dataReg
+        self.statusReg = statusReg
+        self.registers = {}
+        self.lock = threading.Lock()
+
+    def rawread(self, address):
+        if address == self.statusReg:
+            with self.lock:
+                return self.dome.status(self.clock.now())
+        return self.registers.get(address, 0)
+
+    def rawwrite(self, address, value):
+        self.registers[address] = value
+        if address == self.dataReg:
+            with self.lock:
+                self.dome.command(value, self.clock.now())
+
+
+class EncoderBits(object):
+    # Status register bits of the dome as seen by the Position class
+    # The encoder gives quadrature signals on lines A and B, on a rising edge of
+    # A the position changes by one pulse in the direction given by line B. The
+    # zero bit is low while the dome is at zeroAngle.
+
+    def __init__(self, cfg):
+        self.pulsesPerDegree = float(cfg['pulsesPerDegree'])
+        self.zeroAngle = float(cfg['zeroAngle'])
+        self.bitA = int(cfg['bitA'])
+        self.bitB = int(cfg['bitB'])
+        self.zeroBit = int(cfg['zeroBit'])
+        self.invDirection = bool(cfg['invDirection'])
+        self.zeroWidth = 0.5                # Degrees over which the zero sensor is active
+        # (A, B) for the four quarters of a pulse, in the direction of increasing position
+        if self.invDirection:
+            self.quarters = ((0, 1), (1, 1), (1, 0), (0, 0))
+        else:
+            self.quarters = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+    def status(self, pulses):
+        # Status register value at a position in pulses
+        a, b = self.quarters[int(math.floor(pulses * 4)) % 4]
+        value = a * self.bitA | b * self.bitB
+        degrees = pulses / self.pulsesPerDegree
+        if abs((degrees - self.zeroAngle + 180.) % 360. - 180.) >= 0.5 * self.zeroWidth:
+            value |= self.zeroBit
+        return value
+
+
+class SimpleDome(object):
+    # Dome model moving at constant speed without delays
+    # A push on the left or right button starts the motor, a push on the clear
+    # button stops it. Left decreases the position, right increases it.
+
+    def __init__(self, cfg, speed, start):
+        self.encoder = EncoderBits(cfg)
+        self.leftBit = int(cfg['leftBit'])
+        self.rightBit = int(cfg['rightBit'])
+        self.clearBit = int(cfg['clearBit'])
+        self.speed = speed * self.encoder.pulsesPerDegree    # pulses per second
+        self.pulses = start                                  # Position in pulses
+        self.direction = 0
+        self.time = clock.now()
+        self.buttons = 0
+
+    def advance(self, t):
+        self.pulses += self.direction * self.speed * (t - self.time)
+        self.time = t
+
+    def command(self, value, t):
+        self.advance(t)
+        pushed = value & ~self.buttons
+        self.buttons = value
+        if pushed & self.clearBit:
+            self.direction = 0
+        elif pushed & self.leftBit:
+            self.direction = -1
+        elif pushed & self.rightBit:
+            self.direction = 1
+
+    def status(self, t):
+        self.advance(t)
+        return self.encoder.status(self.pulses)
+
+
+def startposition(cfg):
+    # Position in pulses for a simulated dome: the one in the position file,
+    # so the simulated dome continues where the controller left it
+    try:
+        with open(cfg['currentPosFile']) as f:
+            return float(f.read())
+    except (IOError, ValueError):
+        return float(cfg['zeroAngle']) * float(cfg['pulsesPerDegree'])
+
+
+def openport(cfg):
+    # Open the port backend selected in the config
+    backend = cfg['portBackend']
+    if backend == 'inpout':
+        return InpOutPort()
+    if backend == 'ppdev':
+        return PpdevPort(cfg['portDevice'], int(cfg['dataReg']))
+    if backend == 'devport':
+        return DevPort()
+    if backend == 'sim':
+        dome = SimpleDome(cfg, float(cfg['simSpeed']), startposition(cfg))
+        return SimulatedPort(dome, int(cfg['dataReg']), int(cfg['statusReg']))
+    raise ValueError('Unknown port backend: %s' % (backend,))
@@ -0,0 +1,106 @@
+# Relay output scheduler for the dome controller
+#
+# The dome motor is controlled with push buttons on the data register of the
+# printer port: a bit is set for pulseTime seconds and released again. Instead
+# of sleeping in the calling thread for every push, pulses are queued as timed
+# press and release events which are executed by the scheduler thread. Callers
+# return immediately. Pulses are executed one after another in the order they
+# were queued, a pulse queued while another is still pressed starts right when
+# the previous one is released.
+#
+# The scheduler does not write the port directly but changes bits in an
+# OutputRegister, a shadow of the register. Bits are set and cleared under a
+# lock, so callers never overwrite each other's bits, and all changes due at
+# the same time (e.g. the release of one button and the press of the next) are
+# combined into a single port write.
+
+import threading, heapq, logging
+import clock
+
+
+class OutputRegister(object):
+    # Shadow of an output register
+    # change() applies set and clear masks to the shadow, flush() writes the
+    # shadow to the port with write(value) if it differs from the port.
+
+    def __init__(self, write):
+        self.write = write
+        self.lock = threading.Lock()
+        self.state = 0              # Shadow copy of the register
+        self.written = None         # Value last written to the port, unknown at start
+        self.changes = 0            # Number of changes applied
+        self.writes = 0             # Number of port writes
+
+    def change(self, set=0, clear=0):
+        # Atomically clear and then set bits in the shadow
+        with self.lock:
+            self.state = (self.state & ~clear) | set
+            self.changes += 1
+
+    def flush(self):
+        # Write the shadow to the port, returns True if a write was needed
+        with self.lock:
+            if self.state == self.written:
+                return False
+            self.write(self.state)
+            self.written = self.state
+            self.writes += 1
+            return True
+
+
+class RelayScheduler(threading.Thread):
+    # Thread executing queued relay pulses on an OutputRegister
+    # Times are taken from timer, a clock object (see clock.py)
+
+    def __init__(self, register, timer=clock.system):
+        threading.Thread.__init__(self, name='Relays')
+        self.daemon = True
+        self.register = register
+        self.clock = timer
+        self.events = []            # Heap of (time, sequence, bits, press)
+        self.sequence = 0
+        self.free = 0               # Time at which the last queued pulse is released
+        self.lock = threading.Lock()
+        self.wakeup = timer.event()
+
+    def pulse(self, bits, duration):
+        # Queue a push of the given bits for duration seconds
+        # Returns the (planned) start and end time of the pulse
+        with self.lock:
+            start = max(self.clock.now(), self.free)
+            end = start + duration
+            self._push(start, bits, True)
+            self._push(end, bits, False)
+            self.free = end
+            self.wakeup.set()
+        return start, end
+
+    def pending(self):
+        # Number of queued press and release events
+        with self.lock:
+            return len(self.events)
+
+    def _push(self, t, bits, press):
+        self.sequence += 1
+        heapq.heappush(self.events, (t, self.sequence, bits, press))
+
+    def run(self):
+        try:
+            while True:
+                with self.lock:
+                    self.wakeup.clear()
+                    now = self.clock.now()
+                    while self.events and self.events[0][0] <= now:
+                        t, sequence, bits, press = heapq.heappop(self.events)
+                        if press:
+                            self.register.change(set=bits)
+                        else:
+                            self.register.change(clear=bits)
+                    # All events of this tick result in a single port write
+                    self.register.flush()
+                    deadline = self.events[0][0] if self.events else None
+                # Wait for the next event or for a new pulse
+                self.clock.waituntil(deadline, self.wakeup)
+        except:
+            logging.error("Error in writing relay outputs, relay scheduler closed")
+            raise
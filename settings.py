@@ -0,0 +1,210 @@
+# Typed settings generated from configspec.ini
+#
+# Reading a value of the config is a string-keyed lookup in a ConfigObj
+# section and a conversion with float() or int(), repeated for every use. A
+# settings class has a slot for every key of the configspec and is filled once
+# per (re)load of the validated config, after which values are read as plain
+# attributes:
+#
+#   Settings = settings.fromconfig(cfg)
+#   Settings.trackInterval
+#
+# The class is generated from the checks of the configspec: float and integer
+# values are converted with float() and int(), booleans as the validator does
+# (so values overridden with strings are converted too) and other values are
+# taken as they are. The source of the class is shown with
+#
+#   python settings.py [configspec.ini]
+#
+# A Watcher thread reloads the config when its file changes and notifies the
+# subscribers of the keys whose values changed, so a running controller picks
+# up a new config without a full reload of every subsystem.
+#
+# A config file can hold several domes, each as a section under [domes] with
+# the values in which it differs from the top level:
+#
+#   [domes]
+#   [[west]]
+#   dataReg = 888
+#   currentPosFile = west.txt
+#
+# domeconfig() gives the validated config of a single dome, a Watcher with a
+# dome follows the config of that dome.
+#
+# configobj and validate are imported when a config is read, so modules using
+# the settings import without them.
+
+import os, sys, threading, logging
+import clock
+
+CONVERSIONS = {'float': 'float', 'integer': 'int', 'boolean': 'is_boolean'}
+
+_classes = {}           # Generated classes by the checks of their configspec
+
+
+def _checks(spec):
+    # (key, check) of a configspec file or a parsed configspec (cfg.configspec)
+    from configobj import ConfigObj
+    if not hasattr(spec, 'items'):
+        spec = ConfigObj(spec, list_values=False)
+    return [(key, check) for key, check in spec.items() if not hasattr(check, 'items')]
+
+
+def source(spec, name='Settings'):
+    # Python source of the settings class of a configspec
+    from validate import Validator
+    validator = Validator()
+    lines = ['class %s(object):' % name,
+             '    # Typed values of the config, generated from the configspec by settings.py',
+             '',
+             '    __slots__ = (%s)' % ''.join('%r, ' % key for key, check in _checks(spec)),
+             '',
+             '    def fill(self, cfg):']
+    for key, check in _checks(spec):
+        conversion = CONVERSIONS.get(validator._parse_check(check)[0])
+        if conversion:
+            lines.append('        self.%s = %s(cfg[%r])' % (key, conversion, key))
+        else:
+            lines.append('        self.%s = cfg[%r]' % (key, key))
+    lines.append('        return self')
+    return '\n'.join(lines) + '\n'
+
+
+def settingsclass(spec, name='Settings'):
+    # Settings class of a configspec, generated once per configspec
+    checks = tuple(_checks(spec))
+    if (checks, name) not in _classes:
+        from validate import is_boolean
+        namespace = {'is_boolean': is_boolean}
+        exec(source(spec, name), namespace)
+        _classes[checks, name] = namespace[name]
+    return _classes[checks, name]
+
+
+def fromconfig(cfg):
+    # Settings filled from a validated config, with the class of its configspec
+    return settingsclass(cfg.configspec)().fill(cfg)
+
+
+def domenames(cfg):
+    # Names of the domes of a config, empty when the config is a single dome
+    domes = cfg.get('domes')
+    if not hasattr(domes, 'sections'):
+        return []
+    return list(domes.sections)
+
+
+def domeconfig(cfg, name, specfile):
+    # Validated config of a dome: the top level values of cfg with those of its
+    # section under [domes]. Returns None when the result does not validate.
+    from configobj import ConfigObj
+    from validate import Validator
+    values = dict((key, cfg[key]) for key in cfg.scalars)
+    section = cfg['domes'][name]
+    values.update((key, section[key]) for key in section.scalars)
+    dome = ConfigObj(values, configspec=specfile)
+    dome.filename = cfg.filename
+    if dome.validate(Validator()) is not True:
+        return None
+    return dome
+
+
+def diff(old, new):
+    # Keys whose values differ between two settings
+    return set(key for key in new.__slots__ if getattr(old, key, None) != getattr(new, key))
+
+
+class Watcher(threading.Thread):
+    # Thread reloading the config file when it changes
+    # The modification time and size of the file are checked every interval
+    # seconds. A changed file is read and validated into a new config, a file
+    # which does not validate is logged and the current config is kept. apply
+    # is called with the new config and settings, then every subscriber whose
+    # keys changed, with the set of those keys. With a dome the config of that
+    # dome is applied (see domeconfig). With an interval of 0 the thread waits
+    # until setinterval() gives it one, the file is then only read by reload().
+
+    def __init__(self, filename, specfile, apply, current, interval=2., timer=clock.system, dome=None):
+        threading.Thread.__init__(self, name='Config' if dome is None else 'Config-%s' % (dome,))
+        self.daemon = True
+        self.filename = filename
+        self.specfile = specfile
+        self.dome = dome
+        self.apply = apply
+        self.settings = current
+        self.interval = interval
+        self.clock = timer
+        self.wakeup = timer.event()         # Set when the interval changes
+        self.lock = threading.Lock()        # One reload at a time
+        self.subscribers = []               # (keys, callback)
+        self.signature = self.stat()
+
+    def stat(self):
+        # Modification time and size of the file, None when it cannot be read
+        if not self.filename:
+            return None
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def setinterval(self, interval):
+        self.interval = interval
+        self.wakeup.set()
+
+    def subscribe(self, keys, callback):
+        self.subscribers.append((frozenset(keys), callback))
+
+    def reload(self):
+        # Read the file, apply it and notify the subscribers of the changed keys
+        # Returns False when the file cannot be read or does not validate
+        from configobj import ConfigObj, ConfigObjError
+        from validate import Validator
+        with self.lock:
+            self.signature = self.stat()
+            try:
+                cfg = ConfigObj(self.filename, configspec=self.specfile, file_error=True)
+            except (ConfigObjError, IOError) as e:
+                logging.error('Error reading config file: %s' % (e,))
+                return False
+            cfg.stringify = True
+            if cfg.validate(Validator()) is not True:
+                logging.error('Error in config file, the current config is kept')
+                return False
+            if self.dome is not None:
+                if self.dome not in domenames(cfg):
+                    logging.error('Dome %s not in config file, its current config is kept' % (self.dome,))
+                    return False
+                cfg = domeconfig(cfg, self.dome, self.specfile)
+                if cfg is None:
+                    logging.error('Error in config of dome %s, its current config is kept' % (self.dome,))
+                    return False
+            values = fromconfig(cfg)
+            changed = diff(self.settings, values)
+            self.settings = values
+            self.apply(cfg, values)
+            if changed:
+                logging.info('Config%s changed: %s' % ('' if self.dome is None else ' of dome %s' % (self.dome,),
+                                                       ', '.join(sorted(changed))))
+            for keys, callback in self.subscribers:
+                if keys & changed:
+                    try:
+                        callback(keys & changed)
+                    except Exception:
+                        logging.exception('Error applying config changes')
+            return True
+
+    def run(self):
+        while True:
+            self.wakeup.clear()
+            if self.interval > 0:
+                self.clock.waituntil(self.clock.now() + self.interval, self.wakeup)
+            else:
+                self.clock.waituntil(None, self.wakeup)
+            if self.interval > 0 and self.stat() != self.signature:
+                self.reload()
+
+
+if __name__ == '__main__':
+    sys.stdout.write(source(sys.argv[1] if len(sys.argv) > 1 else 'configspec.ini'))
@@ -0,0 +1,319 @@
+# Physics based simulation of the dome for koepelX
+#
+# The Position and Movement threads of koepelX are run unchanged against a
+# simulated printer port with a virtual clock (see clock.py) as the clock of
+# koepelX, so a night of tracking replays in seconds. The dome model has a
+# motor which spins up and coasts down at a limited rate, relays which act
+# with a delay, a quadrature encoder and a zero sensor at zeroAngle. The telescope follows stars at the
+# sidereal rate and slews to a new target at a fixed interval.
+#
+# Usage: python simulator.py [--hours 8] [--seed 1] ...
+#        (python simulator.py --help for all options)
+
+import os, sys, math, random, logging, tempfile, threading, optparse, time
+from configobj import ConfigObj
+from validate import Validator
+import clock, ports
+from telescope import ComSource, SIDEREAL, azalt
+import koepelX
+
+INF = float('inf')
+EPS = 1e-9                      # Time after a boundary at which the status has changed
+
+
+def _sign(x):
+    return (x > 0) - (x < 0)
+
+
+class PhysicsDome(object):
+    # Dome model with motor inertia, relay latency and encoder output
+    # Pushing the left or right button makes the motor run at speed after
+    # latency seconds, pushing the clear button makes it coast down. The motor
+    # spins up at accel and slows down at decel (degrees per second squared).
+    # Left decreases the position, right increases it. Positions are kept in
+    # degrees, time in seconds of the clock driving the model.
+
+    def __init__(self, cfg, start=0., speed=3., accel=2., decel=4., latency=0.05, t=0.):
+        self.encoder = ports.EncoderBits(cfg)
+        self.leftBit = int(cfg['leftBit'])
+        self.rightBit = int(cfg['rightBit'])
+        self.clearBit = int(cfg['clearBit'])
+        self.speed = speed
+        self.accel = accel
+        self.decel = decel
+        self.latency = latency
+        self.position = start           # Position in degrees
+        self.velocity = 0.              # Velocity in degrees per second
+        self.target = 0.                # Velocity the motor is heading for
+        self.time = t
+        self.pending = []               # Commands (time, target velocity) still in the relays
+        self.buttons = 0
+        # Statistics
+        self.starts = 0                 # Number of times the motor was started
+        self.stops = 0                  # Number of times the motor was stopped
+        self.travel = 0.                # Total distance moved in degrees
+
+    def command(self, value, t):
+        # New value of the relay outputs at time t
+        self.advance(t)
+        pushed = value & ~self.buttons
+        self.buttons = value
+        if pushed & self.clearBit:
+            self.pending.append((t + self.latency, 0.))
+        elif pushed & self.leftBit:
+            self.pending.append((t + self.latency, -self.speed))
+        elif pushed & self.rightBit:
+            self.pending.append((t + self.latency, self.speed))
+
+    def status(self, t):
+        # Status register at time t
+        self.advance(t)
+        return self.encoder.status(self.position * self.encoder.pulsesPerDegree)
+
+    def segments(self, velocity, target):
+        # Motion towards the target velocity as (duration, acceleration, final
+        # velocity) parts, the velocity never changes sign within a part
+        parts = []
+        if velocity != 0 and _sign(target) != _sign(velocity):
+            # Coast down before stopping or reversing
+            parts.append((abs(velocity) / self.decel, -_sign(velocity) * self.decel, 0.))
+            velocity = 0.
+        if velocity != target:
+            rate = self.accel if abs(target) > abs(velocity) else self.decel
+            parts.append((abs(target - velocity) / rate, _sign(target - velocity) * rate, target))
+        parts.append((INF, 0., target))
+        return parts
+
+    def advance(self, t):
+        # Move the model forward to time t
+        while self.time < t:
+            limit = min(t, self.pending[0][0]) if self.pending else t
+            for duration, a, final in self.segments(self.velocity, self.target):
+                end = min(self.time + duration, limit)
+                step = end - self.time
+                distance = self.velocity * step + 0.5 * a * step * step
+                self.position += distance
+                self.travel += abs(distance)
+                self.time = end
+                if end == limit:
+                    self.velocity += a * step
+                    break
+                # End of a part, the final velocity is exact
+                self.velocity = final
+            if self.pending and self.pending[0][0] <= self.time:
+                self._apply(self.pending.pop(0)[1])
+
+    def _apply(self, target):
+        if target != self.target:
+            if target == 0:
+                self.stops += 1
+            else:
+                self.starts += 1
+        self.target = target
+
+    def nextchange(self, t):
+        # First time after t at which the status register can change
+        self.advance(t)
+        x, v, target, now = self.position, self.velocity, self.target, self.time
+        pending = list(self.pending)
+        while True:
+            limit = pending[0][0] if pending else INF
+            for duration, a, final in self.segments(v, target):
+                end = min(now + duration, limit)
+                direction = _sign(v) or _sign(a)
+                if direction:
+                    tau = _reach(v, a, self._boundary(x, direction) - x, end - now)
+                    if tau is not None:
+                        return now + tau + EPS
+                step = end - now
+                x += v * step + 0.5 * a * step * step
+                now = end
+                if end == limit:
+                    v += a * step
+                    break
+                v = final
+            if not pending:
+                return INF
+            target = pending.pop(0)[1]
+
+    def _boundary(self, x, direction):
+        # Nearest position in the given direction at which the status changes
+        ppd = self.encoder.pulsesPerDegree
+        quarter = math.floor(x * ppd * 4)
+        if direction > 0:
+            boundary = (quarter + 1) / (4 * ppd)
+        else:
+            boundary = quarter / (4 * ppd)
+        # Edges of the zero sensor
+        half = 0.5 * self.encoder.zeroWidth
+        z = (x - self.encoder.zeroAngle + 180.) % 360. - 180.
+        for edge in (-half, half):
+            candidate = x + direction * ((direction * (edge - z)) % 360.)
+            if direction * (candidate - boundary) < 0:
+                boundary = candidate
+        return boundary
+
+
+def _reach(v, a, d, limit):
+    # Smallest time in [0, limit] after which v*t + a*t^2/2 equals d
+    if a == 0:
+        if v == 0:
+            return None
+        tau = d / v
+    else:
+        disc = v * v + 2 * a * d
+        if disc < 0:
+            return None
+        root = math.sqrt(disc)
+        taus = [tau for tau in ((-v + root) / a, (-v - root) / a) if tau >= 0]
+        if not taus:
+            return None
+        tau = min(taus)
+    if 0 <= tau <= limit:
+        return tau
+    return None
+
+
+class SiderealTelescope(object):
+    # Telescope following stars, with the interface of TheSkyX's RASCOMTele
+    # A new random target above minAlt is chosen every interval seconds.
+
+    IsConnected = 1
+
+    def __init__(self, timer, latitude=53.24, interval=1800., minAlt=25., seed=1):
+        self.clock = timer
+        self.latitude = latitude
+        self.interval = interval
+        self.minAlt = minAlt
+        self.random = random.Random(seed)
+        self.targets = []               # (hour angle at time 0, declination) per interval
+        self.dAz = 0.
+        self.dAlt = 0.
+
+    def Connect(self):
+        pass
+
+    def target(self, index):
+        while len(self.targets) <= index:
+            t = len(self.targets) * self.interval
+            while True:
+                ha, dec = self.random.uniform(-60., 60.), self.random.uniform(-10., 80.)
+                if azalt(ha, dec, self.latitude)[1] > self.minAlt:
+                    break
+            # Hour angle at time 0 such that it has the chosen value at the start of the interval
+            self.targets.append((ha - SIDEREAL * t, dec))
+        return self.targets[index]
+
+    def azalt(self, t):
+        ha, dec = self.target(int(t // self.interval))
+        return azalt(ha + SIDEREAL * t, dec, self.latitude)
+
+    def GetAzAlt(self):
+        self.dAz, self.dAlt = self.azalt(self.clock.now())
+
+
+def loadconfig(filename='config.ini', **overrides):
+    # Validated config with overridden values, the configspec is read from
+    # the directory of the config file
+    specfile = os.path.join(os.path.dirname(filename), 'configspec.ini')
+    cfg = ConfigObj(filename, configspec=specfile)
+    cfg.stringify = True
+    cfg.validate(Validator())
+    cfg.update(overrides)
+    return cfg
+
+
+class Simulation(object):
+    # koepelX running on a simulated dome and a virtual clock
+    # The Position, Movement, relay and telescope threads of koepelX take part
+    # in the simulation, the server and telemetry threads are not started.
+    # source is a function of the clock returning the telescope source (see
+    # telescope.py), by default koepelX reads the simulated telescope.
+
+    def __init__(self, cfg, telescope=None, start=None, source=None, **dome):
+        self.clock = clock.VirtualClock()
+        self.cfg = cfg
+        if start is None:
+            start = float(cfg['zeroAngle'])
+        self.dome = PhysicsDome(cfg, start=start, t=self.clock.now(), **dome)
+        self.port = ports.SimulatedPort(self.dome, int(cfg['dataReg']), int(cfg['statusReg']), self.clock)
+        self.telescope = telescope or SiderealTelescope(self.clock)
+
+        # Position file of the simulated dome
+        fd, self.positionFile = tempfile.mkstemp(prefix='domesim', suffix='.txt')
+        os.write(fd, str(start * float(cfg['pulsesPerDegree'])).encode())
+        os.close(fd)
+        cfg['currentPosFile'] = self.positionFile
+        cfg['traceFile'] = ''
+        cfg['currentModeFile'] = ''
+
+        # Run koepelX on the simulated port and the virtual clock
+        if source is None:
+            source = lambda timer: ComSource(lambda: self.telescope)
+        koepelX.setup(cfg, self.clock)
+        self.controller = koepelX.adddome('sim', cfg, self.port, source(self.clock))
+        self.move = self.controller.move
+
+    def start(self):
+        # Start the threads of koepelX, the calling thread drives the simulation
+        self.clock.enter()
+        self.encoder = self.controller.position
+        for thread in (self.controller.relays, self.controller.telescope, self.encoder, self.move):
+            thread.daemon = True
+            self.clock.start(thread)
+        # Polls of the encoder are only needed when the status can change
+        self.clock.sethorizon(self.encoder, self.dome.nextchange)
+
+    def run(self, seconds):
+        # Let the simulation run for some (virtual) seconds
+        self.clock.sleep(seconds)
+
+    def stop(self):
+        # Stop the simulation, the threads of koepelX are left waiting forever
+        self.clock.halt()
+        os.remove(self.positionFile)
+
+    def position(self):
+        # Position of the dome according to koepelX in degrees
+        return self.controller.currentPos / float(self.cfg['pulsesPerDegree'])
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--config', default='config.ini', help='config file of koepelX [%default]')
+    parser.add_option('--hours', type='float', default=8., help='length of the night [%default]')
+    parser.add_option('--interval', type='float', default=1800., help='seconds between slews to a new target [%default]')
+    parser.add_option('--seed', type='int', default=1, help='seed of the target selection [%default]')
+    parser.add_option('--latitude', type='float', default=53.24, help='latitude of the site [%default]')
+    parser.add_option('--speed', type='float', default=3., help='dome speed in degrees/s [%default]')
+    parser.add_option('--accel', type='float', default=2., help='spin-up in degrees/s^2 [%default]')
+    parser.add_option('--decel', type='float', default=4., help='coast-down in degrees/s^2 [%default]')
+    parser.add_option('--latency', type='float', default=0.05, help='relay latency in seconds [%default]')
+    parser.add_option('--log', default=None, help='log file of koepelX [none]')
+    options, args = parser.parse_args()
+
+    if options.log:
+        logging.basicConfig(level=logging.DEBUG, filename=options.log, filemode='w',
+                            format='%(relativeCreated)d %(levelname)-8s %(message)s')
+    else:
+        logging.basicConfig(level=logging.CRITICAL)
+
+    cfg = loadconfig(options.config)
+    sim = Simulation(cfg, speed=options.speed, accel=options.accel, decel=options.decel, latency=options.latency)
+    sim.telescope = SiderealTelescope(sim.clock, options.latitude, options.interval, seed=options.seed)
+
+    started = time.time()
+    sim.start()
+    sim.move.track()
+    sim.run(options.hours * 3600.)
+    elapsed = time.time() - started
+    sim.stop()
+
+    print('Simulated %.1f hours in %.1f s (%.0fx real time, %d clock steps)' %
+          (options.hours, elapsed, options.hours * 3600. / elapsed, sim.clock.steps))
+    print('Motor starts: %d, stops: %d, dome travel: %.1f degrees' % (sim.dome.starts, sim.dome.stops, sim.dome.travel))
+    print('Dome at %.2f degrees, koepelX at %.2f degrees' % (sim.dome.position, sim.position()))
+
+
+if __name__ == '__main__':
+    main()
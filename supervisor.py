@@ -0,0 +1,192 @@
+# Supervisor of koepelX
+#
+# Starts koepelX as a child process and checks every --interval seconds that
+# it answers the PING command on its server port, which koepelX does not log. When the process exits or
+# misses --failures checks in a row it is stopped (terminated, killed after
+# --kill-timeout seconds) and started again with --resume, so every dome takes
+# up the action kept in its currentModeFile (track, goto or calibrate) from
+# the position kept in its currentPosFile (see posWriteInterval).
+#
+# A restart takes at most failures * (interval + timeout) to detect a hang,
+# kill-timeout to stop the process, the restart delay and start-timeout for
+# the new process to answer. The delay starts at --delay seconds and doubles
+# up to --max-delay for every restart within --stable seconds of the previous
+# one, so a controller which fails at once is not restarted in a tight loop.
+#
+# Restarts and downtime are logged at every restart and printed when the
+# supervisor is stopped with Ctrl-C. The downtime of a restart runs from the
+# last answered check to the first answer of the new process.
+#
+#   python supervisor.py [--config config.ini] [--interval 2] ...
+#
+# On Linux the dome is simulated with portBackend = sim in the config file.
+
+import os, sys, socket, subprocess, logging, optparse
+from configobj import ConfigObj
+from validate import Validator
+import clock
+
+
+class Supervisor(object):
+    # Runs command, a koepelX answering on address (host, port), and restarts it
+
+    def __init__(self, command, address, interval=2., timeout=5., failures=3, startTimeout=30.,
+                 killTimeout=5., restartDelay=1., maxDelay=30., stable=60., timer=clock.system):
+        self.command = command
+        self.address = address
+        self.interval = interval
+        self.timeout = timeout
+        self.failures = failures
+        self.startTimeout = startTimeout
+        self.killTimeout = killTimeout
+        self.restartDelay = restartDelay
+        self.maxDelay = maxDelay
+        self.stable = stable
+        self.clock = timer
+        self.process = None
+        self.delay = restartDelay
+        self.restarts = 0
+        self.downtime = 0.              # Seconds without an answering koepelX, over all restarts
+        self.lastAnswer = None          # Time of the last answered check
+        self.lastRestart = None
+
+    def check(self):
+        # First line of the answer to PING, None when koepelX does not answer
+        try:
+            sock = socket.create_connection(self.address, self.timeout)
+        except socket.error:
+            return None
+        try:
+            sock.settimeout(self.timeout)
+            sock.sendall('PING')
+            answer = ''
+            while '\n' not in answer:
+                data = sock.recv(1024)
+                if not data:
+                    break
+                answer += data
+        except socket.error:
+            return None
+        finally:
+            sock.close()
+        if '\n' not in answer:
+            return None
+        return answer.split('\n')[0]
+
+    def start(self, resume=False):
+        command = self.command + (['--resume'] if resume else [])
+        logging.info('Starting %s' % (' '.join(command),))
+        self.process = subprocess.Popen(command)
+
+    def waitup(self):
+        # Wait for the first answer of a started koepelX
+        # Returns False when it exits or does not answer within startTimeout
+        deadline = self.clock.now() + self.startTimeout
+        while self.clock.now() < deadline:
+            if self.process.poll() is not None:
+                logging.error('koepelX exited at its start with code %s' % (self.process.returncode,))
+                return False
+            if self.check() is not None:
+                self.lastAnswer = self.clock.now()
+                return True
+            self.clock.sleep(0.1)
+        logging.error('koepelX does not answer %s s after its start' % (self.startTimeout,))
+        return False
+
+    def watch(self):
+        # Check koepelX every interval, returns when it exits or misses failures checks in a row
+        missed = 0
+        while True:
+            self.clock.sleep(self.interval)
+            if self.process.poll() is not None:
+                logging.error('koepelX exited with code %s' % (self.process.returncode,))
+                return
+            if self.check() is None:
+                missed += 1
+                logging.warning('koepelX does not answer (%d of %d)' % (missed, self.failures))
+                if missed >= self.failures:
+                    return
+            else:
+                missed = 0
+                self.lastAnswer = self.clock.now()
+
+    def stop(self):
+        # Terminate koepelX, kill it when it is still running after killTimeout
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        deadline = self.clock.now() + self.killTimeout
+        while self.process.poll() is None and self.clock.now() < deadline:
+            self.clock.sleep(0.05)
+        if self.process.poll() is None:
+            logging.warning('koepelX does not stop, killed')
+            self.process.kill()
+            self.process.wait()
+
+    def restart(self):
+        # Stop koepelX and start it again with --resume after the restart delay
+        self.stop()
+        now = self.clock.now()
+        if self.lastRestart is not None and now - self.lastRestart < self.stable:
+            self.delay = min(2 * self.delay, self.maxDelay)
+        else:
+            self.delay = self.restartDelay
+        self.lastRestart = now
+        self.clock.sleep(self.delay)
+        self.restarts += 1
+        self.start(resume=True)
+
+    def run(self):
+        # Start koepelX and keep it running
+        self.start()
+        up = self.waitup()
+        while True:
+            if up:
+                self.watch()
+            down = self.lastAnswer if self.lastAnswer is not None else self.clock.now()
+            self.restart()
+            up = self.waitup()
+            if up:
+                self.downtime += self.lastAnswer - down
+                logging.info('koepelX restarted, down for %.1f s. %s' % (self.lastAnswer - down, self.report()))
+
+    def report(self):
+        return 'Restarts: %d, downtime %.1f s' % (self.restarts, self.downtime)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--config', default='config.ini', help='config file of koepelX [%default]')
+    parser.add_option('--interval', type='float', default=2., help='seconds between checks [%default]')
+    parser.add_option('--timeout', type='float', default=5., help='seconds to wait for an answer [%default]')
+    parser.add_option('--failures', type='int', default=3, help='missed checks in a row before a restart [%default]')
+    parser.add_option('--start-timeout', type='float', default=30., help='seconds to wait for the first answer [%default]')
+    parser.add_option('--kill-timeout', type='float', default=5., help='seconds to wait before killing koepelX [%default]')
+    parser.add_option('--delay', type='float', default=1., help='seconds before a restart [%default]')
+    parser.add_option('--max-delay', type='float', default=30., help='longest delay before a restart [%default]')
+    parser.add_option('--stable', type='float', default=60., help='seconds after which the delay is reset [%default]')
+    parser.add_option('--log', help='log file, by default the log goes to stderr')
+    options, args = parser.parse_args()
+
+    cfg = ConfigObj(options.config, configspec=os.path.join(os.path.dirname(options.config), 'configspec.ini'))
+    if cfg.validate(Validator()) is not True:
+        print('Error in configfile')
+        return 1
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s',
+                        datefmt='%a, %d %b %Y %H:%M:%S', filename=options.log)
+
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'koepelX.py'),
+               '--config', options.config]
+    supervisor = Supervisor(command, (socket.gethostname(), cfg['serverPort']), options.interval, options.timeout,
+                            options.failures, options.start_timeout, options.kill_timeout, options.delay,
+                            options.max_delay, options.stable)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        supervisor.stop()
+        print(supervisor.report())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+# Telemetry recorder for the dome controller
+#
+# Samples of the dome state are appended to fixed-width binary column files,
+# one file per quantity and one directory per night:
+#
+#   <telemetryDir>/<YYYYMMDD>/time.f8, position.f8, busy.u1, ...
+#
+# The file extension is the numpy dtype of the column (always little endian),
+# so a column can be mapped directly with
+#   numpy.memmap('telemetry/20240101/position.f8', dtype='<f8', mode='r')
+# or with load() below. Columns are appended in batches by a single writer
+# thread; callers only put samples in a queue and never wait for the disk.
+# A recorder can write the samples of several domes, each to a directory of
+# its own (see record()).
+
+import os, time, struct, threading, logging
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+# Column names with their numpy dtype, in the order of a sample tuple
+COLUMNS = (('time', 'f8'),          # Unix time of the sample
+           ('position', 'f8'),      # Dome position in pulses
+           ('busy', 'u1'),          # Dome busy flag
+           ('action', 'u1'),        # Index of the current action in ACTIONS
+           ('teleaz', 'f4'),        # Telescope azimuth in degrees (nan if unknown)
+           ('telealt', 'f4'),       # Telescope altitude in degrees (nan if unknown)
+           ('relay', 'u1'))         # Value last written to the relay outputs
+
+# Movement actions as stored in the action column
+ACTIONS = ('', 'goto', 'calibrate', 'track')
+
+# struct formats of the numpy dtypes used above
+_FORMATS = {'f8': 'd', 'f4': 'f', 'u1': 'B'}
+
+# A night starts at noon, so a single night is never split over two directories
+NIGHT_OFFSET = 12 * 3600
+
+
+def nightof(t):
+    # Name of the night (and its directory) the given unix time belongs to
+    return time.strftime('%Y%m%d', time.localtime(t - NIGHT_OFFSET))
+
+
+def actionindex(action):
+    # Column value of a movement action, unknown actions are stored as 0
+    try:
+        return ACTIONS.index(action)
+    except ValueError:
+        return 0
+
+
+class ColumnWriter(object):
+    # Appends batches of samples to the column files of the current night
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.night = None
+        self.files = []
+
+    def open(self, night):
+        # Close the columns of the previous night and open those of a new night
+        self.close()
+        path = os.path.join(self.directory, night)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.files = [open(os.path.join(path, '%s.%s' % column), 'ab') for column in COLUMNS]
+        self.night = night
+        logging.info('Telemetry recorded in %s' % (path,))
+
+    def close(self):
+        for f in self.files:
+            f.close()
+        self.files = []
+        self.night = None
+
+    def write(self, samples):
+        # Write a batch of samples, splitting it where a new night begins
+        start = 0
+        while start < len(samples):
+            night = nightof(samples[start][0])
+            end = start + 1
+            while end < len(samples) and nightof(samples[end][0]) == night:
+                end += 1
+            if night != self.night:
+                self.open(night)
+            self._append(samples[start:end])
+            start = end
+
+    def _append(self, samples):
+        n = len(samples)
+        for i, (name, dtype) in enumerate(COLUMNS):
+            values = [sample[i] for sample in samples]
+            self.files[i].write(struct.pack('<%d%s' % (n, _FORMATS[dtype]), *values))
+        for f in self.files:
+            f.flush()
+
+
+class Recorder(threading.Thread):
+    # Thread writing queued telemetry samples to disk
+    # record() never blocks, when the writer falls behind samples are dropped
+
+    batchSize = 1000            # Maximum number of samples written at once
+
+    def __init__(self, directory, maxQueueSize=10000):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.samples = Queue.Queue(maxQueueSize)
+        self.directory = directory
+        self.writers = {}       # ColumnWriter by directory
+        self.dropped = 0
+
+    def record(self, t, position, busy, action, teleaz, telealt, relay, directory=None):
+        # Queue a sample for directory, by default the directory of the recorder
+        try:
+            self.samples.put_nowait((directory or self.directory, (t, position, int(busy), actionindex(action), teleaz, telealt, relay)))
+        except Queue.Full:
+            self.dropped += 1
+
+    def write(self, batch):
+        # Write a batch of queued samples, in order per directory
+        samples = {}
+        for directory, sample in batch:
+            samples.setdefault(directory, []).append(sample)
+        for directory in samples:
+            if directory not in self.writers:
+                self.writers[directory] = ColumnWriter(directory)
+            self.writers[directory].write(samples[directory])
+
+    def run(self):
+        try:
+            while True:
+                batch = [self.samples.get()]
+                try:
+                    while len(batch) < self.batchSize:
+                        batch.append(self.samples.get_nowait())
+                except Queue.Empty:
+                    pass
+                self.write(batch)
+        except:
+            for writer in self.writers.values():
+                writer.close()
+            logging.error('Error in writing telemetry, recorder closed')
+            raise
+
+
+def nights(directory):
+    # Sorted list of the nights for which telemetry is available
+    if not os.path.isdir(directory):
+        return []
+    return sorted(night for night in os.listdir(directory) if os.path.isdir(os.path.join(directory, night)))
+
+
+def load(directory, night):
+    # Memory-map the columns of a night as numpy arrays
+    # All columns are cut to the same length, so a batch that is being written
+    # while reading never shows up partially.
+    import numpy as np
+
+    path = os.path.join(directory, night)
+    columns = {}
+    for name, dtype in COLUMNS:
+        filename = os.path.join(path, '%s.%s' % (name, dtype))
+        if os.path.getsize(filename) == 0:
+            columns[name] = np.zeros(0, dtype='<' + dtype)
+        else:
+            columns[name] = np.memmap(filename, dtype='<' + dtype, mode='r')
+    n = min(len(column) for column in columns.values())
+    for name in columns:
+        columns[name] = columns[name][:n]
+    return columns
+
+
+def select(directory, start, end):
+    # Samples between the unix times start and end as a dict of numpy arrays
+    import numpy as np
+
+    first, last = nightof(start), nightof(end)
+    parts = []
+    for night in nights(directory):
+        if first <= night <= last:
+            columns = load(directory, night)
+            inside = (columns['time'] >= start) & (columns['time'] <= end)
+            parts.append(dict((name, column[inside]) for name, column in columns.items()))
+    if not parts:
+        return dict((name, np.zeros(0, dtype='<' + dtype)) for name, dtype in COLUMNS)
+    return dict((name, np.concatenate([part[name] for part in parts])) for name, dtype in COLUMNS)
+
+
+def downsample(columns, maxpoints, keys=('position', 'teleaz')):
+    # Reduce the samples to at most maxpoints by min/max bucketing
+    # The samples are split in equal buckets and of every bucket only the
+    # samples holding the minimum and maximum of each of the keys are kept, so
+    # spikes and stalls survive the reduction. Kept samples stay in time order.
+    # Below two samples per key evenly spaced samples are kept instead.
+    import numpy as np
+
+    n = len(columns['time'])
+    perbucket = 2 * len(keys)
+    if n <= maxpoints:
+        return columns
+    if maxpoints < perbucket:
+        keep = np.linspace(0, n - 1, max(maxpoints, 0)).astype(int)
+        return dict((name, column[keep]) for name, column in columns.items())
+
+    buckets = maxpoints // perbucket
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    # nan values (no telescope) never win a min or max
+    lows = [np.where(np.isnan(columns[key]), np.inf, columns[key]) for key in keys]
+    highs = [np.where(np.isnan(columns[key]), -np.inf, columns[key]) for key in keys]
+    keep = []
+    for i in range(buckets):
+        a, b = edges[i], edges[i + 1]
+        for low, high in zip(lows, highs):
+            keep.append(a + np.argmin(low[a:b]))
+            keep.append(a + np.argmax(high[a:b]))
+    keep = np.unique(keep)
+    return dict((name, column[keep]) for name, column in columns.items())
+
+
+def history(directory, start, end, maxpoints):
+    # Downsampled samples between the unix times start and end
+    return downsample(select(directory, start, end), maxpoints)
@@ -0,0 +1,483 @@
+# Telescope position sources for the dome controller
+#
+# A source reads the azimuth and altitude of the telescope. Reading TheSkyX
+# through COM is slow, so a single poller thread reads the source every
+# telescopeInterval seconds and publishes the latest reading with its time.
+# Tracking, the STATUS and TELESCOPE commands and the telemetry all use this
+# reading instead of each making its own round trip to the telescope.
+#
+# Sources, selected with telescopeSource in config.ini:
+#   theskyx   TheSkyX through its RASCOMTele COM interface (Windows)
+#   replay    a recorded track (telescopeFile) replayed from the time of connecting
+#   tcp       a TCP server at telescopeHost:telescopePort answering 'AZALT'
+#             with a line 'azimuth altitude', a stand-in is started with
+#             python telescope.py [--port 65001] [track]
+#   none      no telescope
+# Every source has connect(), read() returning (azimuth, altitude) in degrees,
+# target() returning the destination (azimuth, altitude) of a running slew or
+# None when the telescope is not slewing or the destination is unknown, and
+# close(); connect() and read() raise an exception when the telescope cannot
+# be reached.
+#
+# For tracking ahead of the telescope, the azimuth a while after a reading can
+# be predicted assuming the telescope follows the sky (sidereal) or from a
+# straight line through the recent readings (extrapolate).
+
+import os, sys, math, socket, bisect, threading, logging, collections
+import clock
+
+SIDEREAL = 360. / 86164.0905    # Sidereal rate in degrees per second
+SLEWRATE = 0.5                  # Rate on the sky in degrees per second above which the telescope is slewing
+
+
+class ComSource(object):
+    # Telescope with the interface of TheSkyX's RASCOMTele (Connect,
+    # IsConnected, GetAzAlt, dAz, dAlt), created by factory on connect
+
+    def __init__(self, factory, release=None):
+        self.factory = factory
+        self.release = release
+        self.tele = None
+
+    def connect(self):
+        self.tele = self.factory()
+        self.tele.Connect()
+        if self.tele.IsConnected == 0:
+            raise IOError('Telescope is not connected')
+
+    def read(self):
+        self.tele.GetAzAlt()
+        return self.tele.dAz, self.tele.dAlt
+
+    def target(self):
+        # RASCOMTele does not tell the destination of a slew
+        return None
+
+    def close(self):
+        if self.tele is not None and self.release is not None:
+            self.release()
+        self.tele = None
+
+
+def _dispatch():
+    # Open the telescope interface of TheSkyX for the calling thread
+    # Python Com-interface needs to be re-initialized for seperate thread
+    import pythoncom, win32com.client
+    sys.coinit_flags = 0
+    pythoncom.CoInitialize()
+    return win32com.client.Dispatch("TheSkyXAdaptor.RASCOMTele")
+
+
+def _release():
+    # Uninitialize Com interface
+    import pythoncom
+    pythoncom.CoUninitialize()
+
+
+def TheSkyXSource():
+    return ComSource(_dispatch, _release)
+
+
+class Track(object):
+    # Recorded telescope track, linearly interpolated in time
+    # Times are in seconds from the first sample.
+
+    def __init__(self, times, az, alt):
+        self.times = [t - times[0] for t in times]
+        self.az = _unwrap(az)
+        self.alt = list(alt)
+
+    def duration(self):
+        return self.times[-1]
+
+    def azalt(self, t):
+        # Azimuth and altitude at time t, the first and last sample outside the track
+        i = bisect.bisect_right(self.times, t)
+        if i == 0:
+            return self.az[0] % 360., self.alt[0]
+        if i == len(self.times):
+            return self.az[-1] % 360., self.alt[-1]
+        t0, t1 = self.times[i - 1], self.times[i]
+        f = (t - t0) / (t1 - t0)
+        return ((self.az[i - 1] + f * (self.az[i] - self.az[i - 1])) % 360.,
+                self.alt[i - 1] + f * (self.alt[i] - self.alt[i - 1]))
+
+    def slewend(self, t, rate=SLEWRATE):
+        # Azimuth and altitude where the slew running at time t ends, None when not slewing
+        # A slew is a run of samples moving faster than rate over the sky.
+        i = bisect.bisect_right(self.times, t)
+        end = None
+        while 0 < i < len(self.times):
+            dt = self.times[i] - self.times[i - 1]
+            if dt <= 0 or separation(self.az[i - 1], self.alt[i - 1], self.az[i], self.alt[i]) <= rate * dt:
+                break
+            end = i
+            i += 1
+        if end is None:
+            return None
+        return self.az[end] % 360., self.alt[end]
+
+
+def azalt(ha, dec, latitude):
+    # Azimuth (north through east) and altitude in degrees of an hour angle and declination
+    ha, dec, lat = math.radians(ha), math.radians(dec), math.radians(latitude)
+    alt = math.asin(math.sin(dec) * math.sin(lat) + math.cos(dec) * math.cos(lat) * math.cos(ha))
+    az = math.atan2(-math.sin(ha) * math.cos(dec), math.cos(lat) * math.sin(dec) - math.sin(lat) * math.cos(dec) * math.cos(ha))
+    return math.degrees(az) % 360., math.degrees(alt)
+
+
+def hadec(az, alt, latitude):
+    # Hour angle and declination in degrees of an azimuth and altitude
+    az, alt, lat = math.radians(az), math.radians(alt), math.radians(latitude)
+    dec = math.asin(math.sin(alt) * math.sin(lat) + math.cos(alt) * math.cos(lat) * math.cos(az))
+    ha = math.atan2(-math.sin(az) * math.cos(alt), math.cos(lat) * math.sin(alt) - math.sin(lat) * math.cos(alt) * math.cos(az))
+    return math.degrees(ha), math.degrees(dec)
+
+
+def separation(az1, alt1, az2, alt2):
+    # Angle in degrees between two azimuths and altitudes
+    az1, alt1, az2, alt2 = math.radians(az1), math.radians(alt1), math.radians(az2), math.radians(alt2)
+    c = math.sin(alt1) * math.sin(alt2) + math.cos(alt1) * math.cos(alt2) * math.cos(az2 - az1)
+    return math.degrees(math.acos(min(max(c, -1.), 1.)))
+
+
+def sidereal(az, alt, latitude, dt):
+    # Azimuth and altitude dt seconds later of a telescope at az, alt following the sky
+    ha, dec = hadec(az, alt, latitude)
+    return azalt(ha + SIDEREAL * dt, dec, latitude)
+
+
+def extrapolate(readings, t):
+    # Azimuth and altitude at time t on the least squares lines through
+    # readings of (azimuth, altitude, time)
+    if len(readings) < 2:
+        return readings[-1][:2]
+    times = [reading[2] for reading in readings]
+    n = float(len(times))
+    tmean = sum(times) / n
+    variance = sum((ti - tmean) ** 2 for ti in times)
+    if variance == 0:
+        return readings[-1][:2]
+    result = []
+    for values in (_unwrap([reading[0] for reading in readings]), [reading[1] for reading in readings]):
+        mean = sum(values) / n
+        rate = sum((ti - tmean) * (value - mean) for ti, value in zip(times, values)) / variance
+        result.append(mean + rate * (t - tmean))
+    return result[0] % 360., result[1]
+
+
+def _unwrap(az):
+    # Azimuths without jumps at 0/360 degrees, so they can be interpolated
+    result = []
+    for a in az:
+        if result:
+            a = result[-1] + (a - result[-1] + 180.) % 360. - 180.
+        result.append(a)
+    return result
+
+
+def loadtrack(path):
+    # Track from a file or telemetry night
+    # A track is a CSV file with the columns time (seconds), azimuth and
+    # altitude (degrees), a NumPy .npy file holding the same columns, or a
+    # night directory of the telemetry recorder (see telemetry.py). Lines of a
+    # CSV file which do not start with a number are skipped.
+    if os.path.isdir(path):
+        import telemetry
+        path = os.path.abspath(path)
+        columns = telemetry.load(os.path.dirname(path), os.path.basename(path))
+        rows = zip(columns['time'], columns['teleaz'], columns['telealt'])
+    elif path.endswith('.npy'):
+        import numpy as np
+        rows = np.load(path)[:, :3]
+    else:
+        rows = []
+        for line in open(path):
+            values = line.replace(',', ' ').split()
+            try:
+                rows.append([float(value) for value in values[:3]])
+            except ValueError:
+                continue
+    # Samples without a telescope position are left out
+    rows = [(float(t), float(az), float(alt)) for t, az, alt in rows if not (math.isnan(az) or math.isnan(alt))]
+    if len(rows) < 2:
+        raise ValueError('Track %s has less than two samples' % (path,))
+    rows.sort()
+    return Track([row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows])
+
+
+class ReplaySource(object):
+    # Recorded track replayed from the time of connecting, repeated when it ends
+    # The destination of a slew is where the track stops moving faster than slewRate.
+
+    def __init__(self, track, timer=clock.system, slewRate=SLEWRATE):
+        self.track = track
+        self.clock = timer
+        self.slewRate = slewRate
+        self.start = None
+
+    def connect(self):
+        self.start = self.clock.now()
+
+    def read(self):
+        return self.track.azalt(self.time())
+
+    def target(self):
+        return self.track.slewend(self.time(), self.slewRate)
+
+    def time(self):
+        return (self.clock.now() - self.start) % self.track.duration()
+
+    def close(self):
+        pass
+
+
+class TcpSource(object):
+    # Telescope position from a TCP server answering 'AZALT' with 'azimuth altitude'
+    # and 'SLEW' with the destination of a slew as 'azimuth altitude', or with
+    # 'none' when the telescope is not slewing or the destination is unknown
+
+    def __init__(self, host, port, timeout=5.):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.sock = None
+        self.f = None
+
+    def connect(self):
+        self.close()
+        self.sock = socket.create_connection(self.address, self.timeout)
+        self.f = self.sock.makefile('rb')
+
+    def read(self):
+        line = self.request(b'AZALT\n')
+        az, alt = line.split()[:2]
+        return float(az), float(alt)
+
+    def target(self):
+        values = self.request(b'SLEW\n').split()
+        if len(values) < 2:
+            return None
+        return float(values[0]), float(values[1])
+
+    def request(self, command):
+        self.sock.sendall(command)
+        line = self.f.readline()
+        if not line:
+            raise IOError('Telescope server closed the connection')
+        return line
+
+    def close(self):
+        if self.sock is not None:
+            self.f.close()
+            self.sock.close()
+        self.sock = self.f = None
+
+
+class NoSource(object):
+    # No telescope, connecting always fails
+
+    def connect(self):
+        raise IOError('No telescope source configured')
+
+    def read(self):
+        raise IOError('No telescope source configured')
+
+    def target(self):
+        return None
+
+    def close(self):
+        pass
+
+
+def opensource(cfg, timer=clock.system):
+    # Telescope source selected with telescopeSource in the config
+    source = cfg['telescopeSource']
+    if source == 'theskyx':
+        return TheSkyXSource()
+    elif source == 'replay':
+        return ReplaySource(loadtrack(cfg['telescopeFile']), timer, float(cfg['slewRate']) or SLEWRATE)
+    elif source == 'tcp':
+        return TcpSource(cfg['telescopeHost'], int(cfg['telescopePort']))
+    elif source == 'none':
+        return NoSource()
+    raise ValueError('Unknown telescope source: %s' % (source,))
+
+
+class Poller(threading.Thread):
+    # Thread reading the telescope source and publishing the latest reading
+    # Connects (again) every retry seconds while the source cannot be reached or
+    # fails to read after connecting.
+    # The last history readings are kept for extrapolation.
+
+    def __init__(self, source, interval, retry=10., timer=clock.system, history=100, name='Telescope'):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.source = source
+        self.interval = interval
+        self.retry = retry
+        self.clock = timer
+        self.lock = threading.Lock()
+        self.reading = None         # Latest (azimuth, altitude, time of the clock)
+        self.destination = None     # Destination (azimuth, altitude) of a running slew
+        self.readings = collections.deque(maxlen=history)
+        self.connected = False
+        self.pending = None         # Source replacing the current one
+        self.reads = 0
+        self.failures = 0           # Failed connects and reads since the telescope was last read
+
+    def latest(self):
+        # Latest (azimuth, altitude, time), None before the first reading
+        with self.lock:
+            return self.reading
+
+    def recent(self, seconds):
+        # Readings of the last seconds, oldest first
+        with self.lock:
+            readings = list(self.readings)
+        if not readings:
+            return readings
+        return [reading for reading in readings if reading[2] >= readings[-1][2] - seconds]
+
+    def replace(self, source):
+        # Read another source from the next reading on, the thread of the poller closes
+        # the current one (COM objects belong to the thread which created them)
+        self.pending = source
+
+    def slew(self):
+        # Destination (azimuth, altitude) of a running slew, None when not slewing or unknown
+        with self.lock:
+            return self.destination
+
+    def last(self, n):
+        # The last n readings, oldest first
+        with self.lock:
+            return list(self.readings)[-n:]
+
+    def rate(self):
+        # Rate over the sky in degrees per second between the last two readings, None without two readings
+        readings = self.last(2)
+        if len(readings) < 2 or readings[1][2] <= readings[0][2]:
+            return None
+        (az1, alt1, t1), (az2, alt2, t2) = readings
+        return separation(az1, alt1, az2, alt2) / (t2 - t1)
+
+    def age(self):
+        # Seconds since the latest reading, infinite without a reading
+        reading = self.latest()
+        if reading is None:
+            return float('inf')
+        return self.clock.now() - reading[2]
+
+    def run(self):
+        deadline = self.clock.now()
+        while True:
+            if self.pending is not None:
+                self.source.close()
+                self.source, self.pending = self.pending, None
+                self.connected = False
+                self.failures = 0
+            if not self.connected:
+                try:
+                    self.source.connect()
+                    self.connected = True
+                    logging.info('Connected to telescope.')
+                except Exception as e:
+                    self.source.close()
+                    self.failures += 1
+                    if self.failures == 1:
+                        logging.error('Cannot connect to telescope: %s' % (e,))
+                    deadline = self.clock.now() + self.retry
+                    self.clock.waituntil(deadline)
+                    continue
+            try:
+                az, alt = self.source.read()
+                destination = self.source.target()
+            except Exception as e:
+                # A source which connects but fails to read is retried as a failed connect
+                if self.failures == 0:
+                    logging.error('Connection to telescope lost: %s' % (e,))
+                with self.lock:
+                    self.destination = None
+                self.connected = False
+                self.failures += 1
+                self.source.close()
+                deadline = self.clock.now() + self.retry
+                self.clock.waituntil(deadline)
+                continue
+            with self.lock:
+                self.reading = (az, alt, self.clock.now())
+                self.destination = destination
+                self.readings.append(self.reading)
+            self.reads += 1
+            self.failures = 0
+            deadline = max(deadline + self.interval, self.clock.now())
+            self.clock.waituntil(deadline)
+
+
+class StandIn(object):
+    # Stand-in telescope server for the tcp source, serving a source to every client
+
+    def __init__(self, source, port):
+        self.source = source
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('', port))
+        self.server.listen(5)
+
+    def serve(self):
+        self.source.connect()
+        while True:
+            connection, address = self.server.accept()
+            thread = threading.Thread(target=self.handle, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, connection):
+        f = connection.makefile('rb')
+        try:
+            for line in f:
+                if line.strip().upper() == b'AZALT':
+                    connection.sendall(('%.6f %.6f\n' % self.source.read()).encode())
+                elif line.strip().upper() == b'SLEW':
+                    destination = self.source.target()
+                    connection.sendall(('none\n' if destination is None else '%.6f %.6f\n' % destination).encode())
+        finally:
+            f.close()
+            connection.close()
+
+
+class FixedSource(object):
+    # Telescope standing still
+
+    def __init__(self, az, alt):
+        self.position = (az, alt)
+
+    def connect(self):
+        pass
+
+    def read(self):
+        return self.position
+
+    def target(self):
+        return None
+
+    def close(self):
+        pass
+
+
+def main():
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options] [track]')
+    parser.add_option('--port', type='int', default=65001, help='port to serve on [%default]')
+    parser.add_option('--azalt', type='float', nargs=2, default=(180., 45.),
+                      help='position of the telescope without a track [%default]')
+    options, args = parser.parse_args()
+    if args:
+        source = ReplaySource(loadtrack(args[0]))
+    else:
+        source = FixedSource(*options.azalt)
+    StandIn(source, options.port).serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# Command lifecycle tracing for the dome controller
+#
+# Events are written in the Chrome trace event format (a JSON array of event
+# objects), which can be opened in chrome://tracing or https://ui.perfetto.dev.
+# Every client command gets a request ID at accept; the threads handling the
+# command set it as their current request, so all spans and instants of one
+# command (accept, queue, dispatch, movement, relay pulses, encoder pulses)
+# carry the same ID in their arguments and the 'request' and 'move' async
+# spans are drawn as one track per request.
+# The closing bracket of the array is never written, the format allows this so
+# the file stays valid when the controller is killed.
+
+import os, json, threading, itertools
+import clock
+
+
+class Tracer(object):
+    # Writes trace events of requests, all methods are no-ops when tracing is
+    # disabled or when the calling thread has no current request
+    # Times are taken from timer, a clock object (see clock.py)
+
+    def __init__(self, filename='', timer=clock.system):
+        self.clock = timer
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.ids = itertools.count(1)
+        self.threads = set()
+        self.firstPulse = {}        # Requests waiting for the first encoder pulse, by dome
+        self.pid = os.getpid()
+        self.f = None
+        if filename:
+            self.f = open(filename, 'w')
+            self.f.write('[\n')
+            self.f.flush()
+
+    def enabled(self):
+        return self.f is not None
+
+    def now(self):
+        return self.clock.now()
+
+    def newrequest(self):
+        # New request ID, None when tracing is disabled
+        if self.f is None:
+            return None
+        with self.lock:
+            return next(self.ids)
+
+    def setrequest(self, request):
+        # Set the request the calling thread is working on
+        self.local.request = request
+
+    def request(self):
+        # Request the calling thread is working on
+        return getattr(self.local, 'request', None)
+
+    def instant(self, name, request=None, **args):
+        # Event at the current time
+        request = request or self.request()
+        if self.f is None or request is None:
+            return
+        args['request'] = request
+        self._write({'name': name, 'ph': 'i', 's': 't', 'ts': self._us(self.clock.now()), 'args': args})
+
+    def span(self, name, start, end=None, request=None, **args):
+        # Event from start till end (default now) on the calling thread
+        request = request or self.request()
+        if self.f is None or request is None:
+            return
+        if end is None:
+            end = self.clock.now()
+        args['request'] = request
+        self._write({'name': name, 'ph': 'X', 'ts': self._us(start), 'dur': self._us(end - start), 'args': args})
+
+    def begin(self, name, request=None, start=None, **args):
+        # Start of an async span which may end in another thread
+        self._async('b', name, request, start, args)
+
+    def end(self, name, request=None, **args):
+        # End of an async span
+        self._async('e', name, request, None, args)
+
+    def awaitpulse(self, dome=None):
+        # Report the next encoder pulse of dome for the current request
+        if self.f is not None:
+            request = self.request()
+            if request is None:
+                self.firstPulse.pop(dome, None)
+            else:
+                self.firstPulse[dome] = request
+
+    def pulse(self, dome=None):
+        # Called by the encoder thread of dome on a pulse while firstPulse is not empty
+        request = self.firstPulse.pop(dome, None)
+        if request is not None:
+            self.instant('first encoder pulse', request)
+
+    def _async(self, phase, name, request, start, args):
+        request = request or self.request()
+        if self.f is None or request is None:
+            return
+        args['request'] = request
+        self._write({'name': name, 'cat': 'request', 'ph': phase, 'id': request,
+                     'ts': self._us(start if start is not None else self.clock.now()), 'args': args})
+
+    def _us(self, t):
+        return int(t * 1e6)
+
+    def _write(self, event):
+        thread = threading.current_thread()
+        event['pid'] = self.pid
+        event['tid'] = thread.ident
+        with self.lock:
+            if thread.ident not in self.threads:
+                # Name the thread once, so the viewer shows thread names
+                self.threads.add(thread.ident)
+                self.f.write(json.dumps({'name': 'thread_name', 'ph': 'M', 'pid': self.pid,
+                                         'tid': thread.ident, 'args': {'name': thread.name}}) + ',\n')
+            self.f.write(json.dumps(event) + ',\n')
+            self.f.flush()
@@ -0,0 +1,224 @@
+# Tracking replay benchmark for koepelX
+#
+# Recorded telescope tracks are replayed through Movement._track_ of koepelX
+# on the simulated dome of simulator.py, and the quality of the tracking is
+# reported per track:
+#
+#   off-slit   percentage of the time the telescope was outside the slit
+#   cycles     number of times the motor was started (and stopped again)
+#   travel     total distance moved by the dome in degrees
+#   latency    mean time in seconds from the telescope leaving the slit until
+#              the dome is at rest again with the telescope inside the slit
+#   arrival    mean time in seconds from the end of a slew of the telescope
+#              until the dome is at rest with the telescope inside the slit
+#
+# A track is a CSV file with the columns time (seconds), azimuth and altitude
+# (degrees), a NumPy .npy file holding the same columns, or a night directory
+# of the telemetry recorder (see telescope.loadtrack).
+#
+# With --slew-targets the replayed telescope gives the destination of its
+# slews (see telescope.ReplaySource), otherwise koepelX only sees positions.
+#
+# Config values can be given a list of values with --set, every combination of
+# them is run against every track, so changes to the tracking can be compared
+# over many nights in one batch:
+#
+#   python trackbench.py --set domeOpeningAngle=5,8 --set trackInterval=0.5,1 tracks/*.csv
+
+import time, itertools, optparse, logging
+import simulator, telescope, geometry
+
+FIELDS = ('track', 'settings', 'hours', 'offslit', 'cycles', 'travel', 'latency', 'episodes', 'arrival', 'slews')
+
+
+class ReplayTelescope(object):
+    # Telescope following a recorded track, with the interface of TheSkyX's
+    # RASCOMTele. Time 0 of the clock is the first time of the track.
+
+    IsConnected = 1
+
+    def __init__(self, timer, track):
+        self.clock = timer
+        self.track = track
+        self.dAz = 0.
+        self.dAlt = 0.
+
+    def Connect(self):
+        pass
+
+    def duration(self):
+        return self.track.duration()
+
+    def azalt(self, t):
+        return self.track.azalt(t)
+
+    def GetAzAlt(self):
+        self.dAz, self.dAlt = self.track.azalt(self.clock.now())
+
+
+def offset(az, position):
+    # Angle of the slit azimuth of the telescope from the middle of the slit,
+    # the middle of the slit is at the dome position
+    return (az - position + 180.) % 360. - 180.
+
+
+def slewends(track, rate=telescope.SLEWRATE):
+    # Times at which the slews of a track end
+    ends = []
+    for i in range(1, len(track.times)):
+        dt = track.times[i] - track.times[i - 1]
+        fast = dt > 0 and telescope.separation(track.az[i - 1], track.alt[i - 1], track.az[i], track.alt[i]) > rate * dt
+        if fast and (not ends or ends[-1] != track.times[i - 1]):
+            ends.append(track.times[i])
+        elif fast:
+            ends[-1] = track.times[i]
+    return ends
+
+
+def replay(path, config='config.ini', settings=(), sample=1., dome={}, slewTargets=False):
+    # Track the telescope along a track file on the simulated dome
+    # Returns a dict with the FIELDS of the result
+    cfg = simulator.loadconfig(config, **dict(settings))
+    track = telescope.loadtrack(path)
+    geo = geometry.fromconfig(cfg)
+    source = None
+    if slewTargets:
+        source = lambda timer: telescope.ReplaySource(track, timer, float(cfg['slewRate']) or telescope.SLEWRATE)
+    sim = simulator.Simulation(cfg, start=geo.slitaz(*track.azalt(0)), source=source, **dome)
+    sim.telescope = tele = ReplayTelescope(sim.clock, track)
+    halfOpening = 0.5 * float(cfg['domeOpeningAngle'])
+
+    outside = 0
+    samples = 0
+    leftAt = None               # Time the telescope left the slit
+    latencies = []
+    ends = slewends(track)
+    slewEnd = None              # End of the last slew while the dome has not arrived
+    arrivals = []
+    sim.start()
+    sim.move.track()
+    try:
+        while sim.clock.now() < tele.duration():
+            sim.run(sample)
+            t = sim.clock.now()
+            off = abs(offset(geo.slitaz(*tele.azalt(t)), sim.dome.position))
+            samples += 1
+            while ends and ends[0] <= t:
+                slewEnd = ends.pop(0)
+            resting = sim.dome.velocity == 0 and sim.dome.target == 0 and not sim.dome.pending
+            if off > halfOpening:
+                outside += 1
+                if leftAt is None:
+                    leftAt = t
+            elif resting:
+                if leftAt is not None:
+                    latencies.append(t - leftAt)
+                    leftAt = None
+                if slewEnd is not None:
+                    arrivals.append(t - slewEnd)
+                    slewEnd = None
+    finally:
+        sim.stop()
+
+    return {'track': path,
+            'settings': ' '.join('%s=%s' % setting for setting in settings),
+            'hours': tele.duration() / 3600.,
+            'offslit': 100. * outside / max(samples, 1),
+            'cycles': sim.dome.starts,
+            'travel': sim.dome.travel,
+            'latency': sum(latencies) / len(latencies) if latencies else 0.,
+            'episodes': len(latencies),
+            'arrival': sum(arrivals) / len(arrivals) if arrivals else 0.,
+            'slews': len(arrivals)}
+
+
+def _replay(args):
+    # replay() for a process pool
+    return replay(*args)
+
+
+def grid(sets):
+    # All combinations of the values given with --set as lists of (key, value)
+    keys, values = [], []
+    for item in sets:
+        key, _, value = item.partition('=')
+        keys.append(key.strip())
+        values.append([v.strip() for v in value.split(',')])
+    return [list(zip(keys, combination)) for combination in itertools.product(*values)]
+
+
+def summarize(results):
+    # Results of all tracks combined, weighted by their length
+    hours = sum(r['hours'] for r in results)
+    episodes = sum(r['episodes'] for r in results)
+    slews = sum(r['slews'] for r in results)
+    return {'track': '(%d tracks)' % len(results),
+            'settings': results[0]['settings'],
+            'hours': hours,
+            'offslit': sum(r['offslit'] * r['hours'] for r in results) / hours if hours else 0.,
+            'cycles': sum(r['cycles'] for r in results),
+            'travel': sum(r['travel'] for r in results),
+            'latency': sum(r['latency'] * r['episodes'] for r in results) / episodes if episodes else 0.,
+            'episodes': episodes,
+            'arrival': sum(r['arrival'] * r['slews'] for r in results) / slews if slews else 0.,
+            'slews': slews}
+
+
+def show(result):
+    print('%-24s %-40s %6.1f %8.2f%% %7d %9.1f %8.1f %8d %8.1f %6d' % tuple(result[field] for field in FIELDS))
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] track [track ...]')
+    parser.add_option('--config', default='config.ini', help='config file of koepelX [%default]')
+    parser.add_option('--set', action='append', default=[], metavar='KEY=VALUE[,VALUE...]',
+                      help='config values to run with, may be repeated')
+    parser.add_option('--sample', type='float', default=1., help='seconds between samples of the metrics [%default]')
+    parser.add_option('--jobs', type='int', default=1, help='number of processes running tracks [%default]')
+    parser.add_option('--output', default=None, help='CSV file receiving all results [none]')
+    parser.add_option('--speed', type='float', default=3., help='dome speed in degrees/s [%default]')
+    parser.add_option('--accel', type='float', default=2., help='spin-up in degrees/s^2 [%default]')
+    parser.add_option('--decel', type='float', default=4., help='coast-down in degrees/s^2 [%default]')
+    parser.add_option('--latency', type='float', default=0.05, help='relay latency in seconds [%default]')
+    parser.add_option('--slew-targets', action='store_true', help='the telescope gives the destination of its slews')
+    options, tracks = parser.parse_args()
+    if not tracks:
+        parser.error('no tracks given')
+    logging.basicConfig(level=logging.CRITICAL)
+
+    dome = {'speed': options.speed, 'accel': options.accel, 'decel': options.decel, 'latency': options.latency}
+    runs = [(track, options.config, settings, options.sample, dome, options.slew_targets)
+            for settings in grid(options.set) for track in tracks]
+
+    started = time.time()
+    if options.jobs > 1:
+        # The clock of koepelX is a module global shared by its domes, so every run gets a process of its own
+        import multiprocessing
+        pool = multiprocessing.Pool(options.jobs, maxtasksperchild=1)
+        results = pool.map(_replay, runs, chunksize=1)
+        pool.close()
+    else:
+        results = [_replay(run) for run in runs]
+    elapsed = time.time() - started
+
+    print('%-24s %-40s %6s %9s %7s %9s %8s %8s %8s %6s' % FIELDS)
+    for settings in grid(options.set):
+        name = ' '.join('%s=%s' % setting for setting in settings)
+        group = [result for result in results if result['settings'] == name]
+        for result in group:
+            show(result)
+        if len(group) > 1:
+            show(summarize(group))
+    hours = sum(result['hours'] for result in results)
+    print('Replayed %.1f hours of tracking in %.1f s' % (hours, elapsed))
+
+    if options.output:
+        f = open(options.output, 'w')
+        f.write(','.join(FIELDS) + '\n')
+        for result in results:
+            f.write(','.join(str(result[field]) for field in FIELDS) + '\n')
+        f.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -569,6 +569,7 @@ class Validator(object):
         # tekNico: for use by ConfigObj
         self.baseErrorClass = ValidateError
         self._cache = {}
+        self._compiled = {}
 
 
     def check(self, check, value, missing=False):
@@ -592,18 +593,73 @@ class Validator(object):
         >>> vtor.check('string(default="")', '', missing=True)
         ''
         """
-        fun_name, fun_args, fun_kwargs, default = self._parse_with_caching(check)
+        fun, has_default, default = self.compile(check)
             
         if missing:
-            if default is None:
+            if not has_default:
                 # no information needed here - to be handled by caller
                 raise VdtMissingValue()
-            value = self._handle_none(default)
+            value = default
                 
         if value is None:
             return None
         
-        return self._check_value(value, fun_name, fun_args, fun_kwargs)
+        return fun(value)
+
+
+    def compile(self, check):
+        """
+        Return the compiled form of a check, compiling it on first use.
+        
+        A compiled check is a tuple ``(fun, has_default, default)``. ``fun``
+        checks a single value (not ``None``) with the check function and its
+        arguments already bound, the bounds of ``integer`` and ``float`` checks
+        already converted. ``default`` is the default of the check with
+        ``None`` handled, it is only meaningful if ``has_default`` is true.
+        
+        Check functions are looked up when a check is compiled, so changes to
+        ``functions`` only apply to checks not used before.
+        
+        >>> fun, has_default, default = vtor.compile('integer(0, 9, default=3)')
+        >>> fun('5'), has_default, default
+        (5, True, '3')
+        >>> fun(10)
+        Traceback (most recent call last):
+        VdtValueTooBigError: the value "10" is too big.
+        >>> vtor.compile('pass')[1:]
+        (False, None)
+        """
+        try:
+            return self._compiled[check]
+        except KeyError:
+            pass
+        fun_name, fun_args, fun_kwargs, default = self._parse_with_caching(check)
+        has_default = default is not None
+        if has_default:
+            default = self._handle_none(default)
+        compiled = (self._bind(fun_name, fun_args, fun_kwargs), has_default, default)
+        self._compiled[check] = compiled
+        return compiled
+
+
+    def _bind(self, fun_name, fun_args, fun_kwargs):
+        """Return a function of the value applying a check with its arguments."""
+        try:
+            fun = self.functions[fun_name]
+        except KeyError:
+            def unknown(value):
+                raise VdtUnknownCheckError(fun_name)
+            return unknown
+        if fun in _bounded_checks:
+            bounds = _bounds(fun_args, fun_kwargs, fun is is_float)
+            if bounds is not None:
+                return _bounded_checks[fun](*bounds)
+        if not fun_args and not fun_kwargs:
+            return fun
+        fun_args = tuple(fun_args)
+        if not fun_kwargs:
+            return lambda value: fun(value, *fun_args)
+        return lambda value: fun(value, *fun_args, **fun_kwargs)
 
 
     def _handle_none(self, value):
@@ -725,13 +781,12 @@ class Validator(object):
         If the check doesn't specify a default value then a
         ``KeyError`` will be raised.
         """
-        fun_name, fun_args, fun_kwargs, default = self._parse_with_caching(check)
-        if default is None:
+        fun, has_default, default = self.compile(check)
+        if not has_default:
             raise KeyError('Check "%s" has no default value.' % check)
-        value = self._handle_none(default)
-        if value is None:
-            return value
-        return self._check_value(value, fun_name, fun_args, fun_kwargs)
+        if default is None:
+            return default
+        return fun(default)
 
 
 def _is_num_param(names, values, to_float=False):
@@ -812,19 +867,7 @@ def is_integer(value, min=None, max=None):
     0
     """
     (min_val, max_val) = _is_num_param(('min', 'max'), (min, max))
-    if not isinstance(value, (int, long, StringTypes)):
-        raise VdtTypeError(value)
-    if isinstance(value, StringTypes):
-        # if it's a string - does it represent an integer ?
-        try:
-            value = int(value)
-        except ValueError:
-            raise VdtTypeError(value)
-    if (min_val is not None) and (value < min_val):
-        raise VdtValueTooSmallError(value)
-    if (max_val is not None) and (value > max_val):
-        raise VdtValueTooBigError(value)
-    return value
+    return _integer_check(min_val, max_val)(value)
 
 
 def is_float(value, min=None, max=None):
@@ -864,19 +907,83 @@ def is_float(value, min=None, max=None):
     """
     (min_val, max_val) = _is_num_param(
         ('min', 'max'), (min, max), to_float=True)
-    if not isinstance(value, (int, long, float, StringTypes)):
-        raise VdtTypeError(value)
-    if not isinstance(value, float):
-        # if it's a string - does it represent a float ?
-        try:
-            value = float(value)
-        except ValueError:
+    return _float_check(min_val, max_val)(value)
+
+
+def _integer_check(min_val, max_val):
+    """
+    Return the check of ``is_integer`` for converted bounds.
+    
+    ``is_integer`` uses it too, so both follow the same rules.
+    """
+    def check(value):
+        if not isinstance(value, (int, long, StringTypes)):
             raise VdtTypeError(value)
-    if (min_val is not None) and (value < min_val):
-        raise VdtValueTooSmallError(value)
-    if (max_val is not None) and (value > max_val):
-        raise VdtValueTooBigError(value)
-    return value
+        if isinstance(value, StringTypes):
+            # if it's a string - does it represent an integer ?
+            try:
+                value = int(value)
+            except ValueError:
+                raise VdtTypeError(value)
+        if (min_val is not None) and (value < min_val):
+            raise VdtValueTooSmallError(value)
+        if (max_val is not None) and (value > max_val):
+            raise VdtValueTooBigError(value)
+        return value
+    return check
+
+
+def _float_check(min_val, max_val):
+    """
+    Return the check of ``is_float`` for converted bounds.
+    
+    ``is_float`` uses it too, so both follow the same rules.
+    """
+    def check(value):
+        if not isinstance(value, (int, long, float, StringTypes)):
+            raise VdtTypeError(value)
+        if not isinstance(value, float):
+            # if it's a string - does it represent a float ?
+            try:
+                value = float(value)
+            except ValueError:
+                raise VdtTypeError(value)
+        if (min_val is not None) and (value < min_val):
+            raise VdtValueTooSmallError(value)
+        if (max_val is not None) and (value > max_val):
+            raise VdtValueTooBigError(value)
+        return value
+    return check
+
+
+_bounded_checks = {is_integer: _integer_check, is_float: _float_check}
+
+
+def _bounds(fun_args, fun_kwargs, to_float):
+    """
+    Return the converted ``(min, max)`` of the arguments of a bounded check.
+    
+    Returns ``None`` if the arguments are not just ``min`` and ``max``, or
+    cannot be converted, so the check function reports the error when used.
+    
+    >>> _bounds(['1'], {'max': '5'}, False)
+    [1, 5]
+    >>> _bounds([], {'min': '0.5'}, True)
+    [0.5, None]
+    >>> _bounds(['a'], {}, False)
+    >>> _bounds(['1'], {'min': '2'}, False)
+    """
+    if len(fun_args) > 2:
+        return None
+    params = dict(zip(('min', 'max'), fun_args))
+    for key, value in fun_kwargs.items():
+        if key in params or key not in ('min', 'max'):
+            return None
+        params[key] = value
+    try:
+        return _is_num_param(('min', 'max'), (params.get('min'), params.get('max')), to_float=to_float)
+    except VdtParamError:
+        return None
 
 
 bool_dict = {